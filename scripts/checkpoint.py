@@ -0,0 +1,128 @@
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import TypedDict, List, Optional, Dict, Any
+from scripts.datastore import DataStoreFunctions
+from scripts.env import EnvParams
+from scripts.episode import Episode
+from scripts.qtable import QTable
+import shutil
+import dill
+import os
+
+
+class Checkpoint(TypedDict):
+    Params: EnvParams
+    Episode: int # The next episode to train.
+    Epsilon: float
+    GeneratorState: Dict[str, Any]
+    Streak: int # Consecutive evaluations that met the early stopping targets.
+    Tables: List[QTable]
+    Episodes: List[Episode]
+
+
+class Checkpointer(TypedDict):
+    Params: EnvParams
+    Directory: str
+    Interval: int
+    Keep: int
+    Executor: ThreadPoolExecutor
+    Pending: Optional[Future]
+
+
+class CheckpointFunctions:
+    @staticmethod
+    def Directory(params: EnvParams, hyperparams: Optional[Dict[str, float]] = None) -> str:
+        return f"../runs/checkpoints/{DataStoreFunctions.RunName(params, hyperparams)}"
+
+    @staticmethod
+    def Checkpointer(
+            params: EnvParams,
+            interval: int = 50,
+            keep: int = 3,
+            hyperparams: Optional[Dict[str, float]] = None,
+    ) -> Checkpointer:
+        # Checkpoints are written by a single background thread so training never waits on the disk.
+        directory = CheckpointFunctions.Directory(params, hyperparams)
+        os.makedirs(name=directory, exist_ok=True)
+        return {
+            "Params": params,
+            "Directory": directory,
+            "Interval": interval,
+            "Keep": keep,
+            "Executor": ThreadPoolExecutor(max_workers=1),
+            "Pending": None,
+        }
+
+    @staticmethod
+    def Snapshot(
+            checkpointer: Checkpointer,
+            episode: int,
+            epsilon: float,
+            generator_state: Dict[str, Any],
+            tables: List[QTable],
+            episodes: List[Episode],
+            streak: int = 0,
+    ) -> Checkpoint:
+        # Copies everything training keeps changing, so the snapshot can be written while training continues.
+        return {
+            "Params": checkpointer["Params"],
+            "Episode": episode,
+            "Epsilon": epsilon,
+            "GeneratorState": generator_state,
+            "Streak": streak,
+            "Tables": [dict(table, Values=table["Values"].copy()) for table in tables],
+            "Episodes": list(episodes),
+        }
+
+    @staticmethod
+    def Save(checkpointer: Checkpointer, checkpoint: Checkpoint) -> None:
+        # Only one checkpoint is in flight at a time, which bounds the memory held by snapshots.
+        if checkpointer["Pending"] is not None:
+            checkpointer["Pending"].result()
+        checkpointer["Pending"] = checkpointer["Executor"].submit(
+            CheckpointFunctions.Write, checkpointer["Directory"], checkpoint, checkpointer["Keep"]
+        )
+        return None
+
+    @staticmethod
+    def Write(directory: str, checkpoint: Checkpoint, keep: int) -> str:
+        # Written to a temporary file and renamed into place, so a crash mid-write never leaves a broken checkpoint.
+        path = f"{directory}/{checkpoint['Episode']:08d}.dill"
+        with open(f"{path}.tmp", "wb") as file:
+            dill.dump(checkpoint, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(f"{path}.tmp", path)
+
+        for name in CheckpointFunctions.Versions(directory)[:-keep]:
+            os.remove(f"{directory}/{name}")
+        return path
+
+    @staticmethod
+    def Versions(directory: str) -> List[str]:
+        if not os.path.isdir(directory):
+            return []
+        return sorted(name for name in os.listdir(directory) if name.endswith(".dill"))
+
+    @staticmethod
+    def Load(params: EnvParams, hyperparams: Optional[Dict[str, float]] = None) -> Optional[Checkpoint]:
+        # The latest checkpoint for the params, or None if training never reached one.
+        directory = CheckpointFunctions.Directory(params, hyperparams)
+        versions = CheckpointFunctions.Versions(directory)
+        if not versions:
+            return None
+
+        with open(f"{directory}/{versions[-1]}", "rb") as file:
+            return dill.load(file)
+
+    @staticmethod
+    def Remove(params: EnvParams, hyperparams: Optional[Dict[str, float]] = None) -> None:
+        # Once a run is saved as trained its checkpoints are never resumed again.
+        shutil.rmtree(CheckpointFunctions.Directory(params, hyperparams), ignore_errors=True)
+        return None
+
+    @staticmethod
+    def Close(checkpointer: Checkpointer) -> None:
+        # Waits for the last checkpoint to finish writing.
+        checkpointer["Executor"].shutdown(wait=True)
+        checkpointer["Pending"] = None
+        return None
@@ -1,11 +1,48 @@
-from typing import List, Tuple
-from scripts.policy import PolicyLookup, PolicyFunctions
+from typing import List, Tuple, TypedDict, Optional, Dict, Any, Iterable, Iterator
+from scripts.policy import PolicyLookup
 from scripts.episode import Episode
 from scripts.env import EnvParams
+from scripts.qtable import QTableFunctions, QTable
+import numpy as np
+import sqlite3
+import json
+import re
+import time
 import dill
 import os
 
 
+REGISTRY_PATH = "../runs/registry.sqlite"
+
+# Columns of the registry that can be filtered and sorted on, besides the payload path.
+REGISTRY_COLUMNS = (
+    "Name", "Params", "Seed", "GridX", "GridY", "AgentCount", "FoodCount", "ObstacleCount", "NestCount", "MaxSteps",
+    "EpisodeCount", "ProximityRadius", "Hyperparams", "Created", "Episodes", "FinalSteps", "BestSteps", "FinalReward", "Path",
+)
+
+
+class RunRecord(TypedDict):
+    Name: str
+    Params: EnvParams
+    Seed: int
+    GridX: int
+    GridY: int
+    AgentCount: int
+    FoodCount: int
+    ObstacleCount: int
+    NestCount: int
+    MaxSteps: int
+    EpisodeCount: int
+    ProximityRadius: float
+    Hyperparams: Optional[Dict[str, float]]
+    Created: float
+    Episodes: int
+    FinalSteps: int
+    BestSteps: int
+    FinalReward: float
+    Path: str
+
+
 class DataStoreFunctions:
     @staticmethod
     def ParamsToFileName(params: EnvParams):
@@ -16,31 +53,321 @@ class DataStoreFunctions:
         return name
 
     @staticmethod
-    def Load(params: EnvParams) -> Tuple[List[PolicyLookup], List[Episode]]:
-        os.makedirs(name="../runs", exist_ok=True)
+    def FileNameToParams(name: str) -> Optional[Tuple[EnvParams, Optional[Dict[str, float]]]]:
+        # Parses a name made by RunName back into its params and hyperparams, or None if it is not one.
+        params: Dict[str, Any] = {}
+        hyperparams: Dict[str, float] = {}
+        for match in re.finditer(r"GridSizeX(?P<X>\d+)Y(?P<Y>\d+)|(?P<Key>[A-Za-z]+)(?P<Value>-?\d+(?:\.\d+)?(?:e-?\d+)?)", name):
+            if match["X"] is not None:
+                params["GridSize"] = {"X": int(match["X"]), "Y": int(match["Y"])}
+            elif match["Key"] in EnvParams.__annotations__:
+                params[match["Key"]] = EnvParams.__annotations__[match["Key"]](match["Value"])
+            else:
+                value = match["Value"]
+                hyperparams[match["Key"]] = int(value) if value.lstrip("-").isdigit() else float(value)
 
-        try:
-            with open(f"../runs/{DataStoreFunctions.ParamsToFileName(params)}.dill", "rb") as file:
-                data = dill.load(file)
-                lookups: List[PolicyLookup] = data["Lookups"]
-                episodes: List[Episode] = data["Episodes"]
+        if set(params) != set(EnvParams.__annotations__):
+            return None
+        if DataStoreFunctions.RunName(params, hyperparams or None) != name:
+            return None
+        return params, hyperparams or None
 
-        except FileNotFoundError:
-            lookups, episodes = [], []
-            for _ in range(params["AgentCount"]):
-                lookup = PolicyFunctions.PolicyLookup(params["GridSize"], params["FoodCount"])
-                lookups.append(lookup)
+    @staticmethod
+    def TableSettings(tile_size: int = 1, shared: bool = False) -> Optional[Dict[str, float]]:
+        # Settings that change the layout of a run's tables, stored with its hyperparams so that runs trained with
+        # different layouts never share a name, checkpoint or spill. Runs with the defaults keep their plain name.
+        settings: Dict[str, float] = {}
+        if tile_size != 1:
+            settings["TileSize"] = tile_size
+        if shared:
+            settings["SharedPolicy"] = 1
+        return settings or None
 
-        return lookups, episodes
+    @staticmethod
+    def RunName(params: EnvParams, hyperparams: Optional[Dict[str, float]] = None) -> str:
+        # Runs trained with non-default hyperparams (e.g. by a sweep) are stored separately from the default run.
+        name = DataStoreFunctions.ParamsToFileName(params)
+        if hyperparams:
+            name = name + DataStoreFunctions.ParamsToFileName(hyperparams)
+        return name
 
     @staticmethod
-    def Save(params: EnvParams, lookups: List[PolicyLookup], episodes: List[Episode]) -> None:
+    def Save(
+            params: EnvParams,
+            lookups: Optional[List[PolicyLookup]],
+            episodes: List[Episode],
+            hyperparams: Optional[Dict[str, float]] = None,
+            spilled: Iterable[List[Episode]] = (),
+    ) -> None:
+        # Runs whose policies are stored with SaveTables pass no lookups, which keeps the payload to the episodes.
+        # Episodes spilled to disk during training come before the given ones. Each spilled chunk is copied into the
+        # payload as its own pickle, ahead of the one holding everything else, so they are never all in memory.
         os.makedirs(name="../runs", exist_ok=True)
 
-        with open(f"../runs/{DataStoreFunctions.ParamsToFileName(params)}.dill", "wb") as file:
+        path = DataStoreFunctions.PayloadPath(params, hyperparams)
+        with open(path, "wb") as file:
+            for chunk in spilled:
+                dill.dump(chunk, file)
             dill.dump({
+                "Params": params,
+                "Hyperparams": hyperparams,
                 "Lookups": lookups,
                 "Episodes": episodes,
             }, file)
 
+        DataStoreFunctions.Register(params, DataStoreFunctions.Episodes(path), path, hyperparams)
+        return None
+
+    @staticmethod
+    def PayloadPath(params: EnvParams, hyperparams: Optional[Dict[str, float]] = None) -> str:
+        return f"../runs/{DataStoreFunctions.RunName(params, hyperparams)}.dill"
+
+    @staticmethod
+    def Pickles(path: str) -> Iterator[Any]:
+        # Every pickle in a payload in order: the spilled chunks (if any), then the payload itself.
+        with open(path, "rb") as file:
+            while True:
+                try:
+                    yield dill.load(file)
+                except EOFError:
+                    return
+
+    @staticmethod
+    def Episodes(path: str) -> Iterator[Episode]:
+        # Streams the episodes of a payload one chunk at a time.
+        for data in DataStoreFunctions.Pickles(path):
+            yield from data if isinstance(data, list) else data["Episodes"]
+
+    @staticmethod
+    def Payload(path: str) -> Dict[str, Any]:
+        # The whole payload, with the spilled chunks joined back into its episodes.
+        episodes: List[Episode] = []
+        for data in DataStoreFunctions.Pickles(path):
+            if isinstance(data, list):
+                episodes.extend(data)
+        data["Episodes"] = episodes + data["Episodes"]
+        return data
+
+    @staticmethod
+    def SaveTables(params: EnvParams, tables: List[QTable], hyperparams: Optional[Dict[str, float]] = None) -> None:
+        # Stores every agent's QTable in one .npy file (Agent -> Layer -> Row -> Column -> Action) so that viewers
+        # and evaluators can map it instead of unpickling the lookups. Each save writes a new versioned .npy, then
+        # atomically replaces the .json that names it along with its metadata, so readers always see values and
+        # metadata from the same save and processes that already have an old version mapped are unaffected.
+        os.makedirs(name="../runs", exist_ok=True)
+
+        name = DataStoreFunctions.RunName(params, hyperparams)
+        version = f"{name}.{time.time_ns()}.npy"
+        with open(f"../runs/{version}", "wb") as file:
+            np.save(file, np.stack([table["Values"] for table in tables]))
+            file.flush()
+            os.fsync(file.fileno())
+        with open(f"../runs/{name}.json.tmp", "w") as file:
+            json.dump({"Values": version, "FoodCount": tables[0]["FoodCount"], "TileSize": tables[0]["TileSize"]}, file)
+        os.replace(f"../runs/{name}.json.tmp", f"../runs/{name}.json")
+
+        # Older versions are removed once nothing points at them. Files still mapped elsewhere may refuse to be
+        # removed on some platforms, those are retried on the next save.
+        for other in os.listdir("../runs"):
+            stamp = other[len(name) + 1:-len(".npy")]
+            if other != version and other.startswith(f"{name}.") and other.endswith(".npy") and stamp.isdigit():
+                try:
+                    os.remove(f"../runs/{other}")
+                except OSError:
+                    pass
         return None
+
+    @staticmethod
+    def LoadTables(params: EnvParams, hyperparams: Optional[Dict[str, float]] = None) -> Tuple[Optional[List[QTable]], List[Episode]]:
+        # The saved QTables of a run (see OpenTables) and its episodes, or None and no episodes if it was never
+        # trained. Nothing is allocated for runs that do not exist yet, so callers size their own tables. Runs saved
+        # before tables were stored only have lookups. Those are converted and saved as tables the first time they
+        # are loaded, then opened like any other run.
+        tables = DataStoreFunctions.OpenTables(params, hyperparams)
+        path = DataStoreFunctions.PayloadPath(params, hyperparams)
+        if not os.path.exists(path):
+            return tables, []
+
+        data = DataStoreFunctions.Payload(path)
+        if tables is None and data.get("Lookups"):
+            DataStoreFunctions.SaveTables(params, [QTableFunctions.FromLookup(lookup) for lookup in data["Lookups"]], hyperparams)
+            tables = DataStoreFunctions.OpenTables(params, hyperparams)
+        return tables, data["Episodes"]
+
+    @staticmethod
+    def OpenTables(params: EnvParams, hyperparams: Optional[Dict[str, float]] = None) -> Optional[List[QTable]]:
+        # Opens the saved QTables memory mapped and read only. Opening is nearly free, only the pages that are read
+        # get loaded, and every process that opens the same run shares one copy in the page cache.
+        name = DataStoreFunctions.RunName(params, hyperparams)
+        missing = None
+        while os.path.exists(f"../runs/{name}.json"):
+            with open(f"../runs/{name}.json", "r") as file:
+                meta = json.load(file)
+
+            # Metadata written before versions were named points at the unversioned file. A save can remove the
+            # version between reading the metadata and opening it, in which case the newer metadata is read again.
+            version = meta.get("Values", f"{name}.npy")
+            try:
+                values = np.load(f"../runs/{version}", mmap_mode="r")
+            except FileNotFoundError:
+                if version == missing:
+                    raise
+                missing = version
+                continue
+
+            return [
+                {"Values": values[index], "FoodCount": meta["FoodCount"], "TileSize": meta["TileSize"]}
+                for index in range(values.shape[0])
+            ]
+        return None
+
+    @staticmethod
+    def Registry() -> sqlite3.Connection:
+        # The registry indexes every saved run by its params and summary metrics, so runs can be found and compared
+        # without unpickling their payloads. Payloads are still stored as dill files next to it.
+        os.makedirs(name="../runs", exist_ok=True)
+        connection = sqlite3.connect(REGISTRY_PATH)
+        connection.row_factory = sqlite3.Row
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS Runs (
+                Name TEXT PRIMARY KEY,
+                Params TEXT NOT NULL,
+                Seed INTEGER,
+                GridX INTEGER,
+                GridY INTEGER,
+                AgentCount INTEGER,
+                FoodCount INTEGER,
+                ObstacleCount INTEGER,
+                NestCount INTEGER,
+                MaxSteps INTEGER,
+                EpisodeCount INTEGER,
+                ProximityRadius REAL,
+                Hyperparams TEXT,
+                Created REAL,
+                Episodes INTEGER,
+                FinalSteps INTEGER,
+                BestSteps INTEGER,
+                FinalReward REAL,
+                Path TEXT NOT NULL
+            )
+        """)
+
+        # Registries created before hyperparams were recorded are missing the column.
+        columns = [row["name"] for row in connection.execute("PRAGMA table_info(Runs)")]
+        if "Hyperparams" not in columns:
+            connection.execute("ALTER TABLE Runs ADD COLUMN Hyperparams TEXT")
+
+        connection.execute("CREATE INDEX IF NOT EXISTS RunsByGrid ON Runs (GridX, GridY, BestSteps)")
+        connection.execute("CREATE INDEX IF NOT EXISTS RunsBySeed ON Runs (Seed)")
+        return connection
+
+    @staticmethod
+    def Register(
+            params: EnvParams,
+            episodes: Iterable[Episode],
+            path: str,
+            hyperparams: Optional[Dict[str, float]] = None,
+            created: Optional[float] = None,
+    ) -> None:
+        # A run keeps the creation time it was first registered with when it is saved again or reindexed.
+        name = DataStoreFunctions.RunName(params, hyperparams)
+        connection = DataStoreFunctions.Registry()
+        existing = connection.execute("SELECT Created FROM Runs WHERE Name = ?", [name]).fetchone()
+        connection.close()
+        if existing is not None and existing["Created"] is not None:
+            created = existing["Created"]
+
+        # The summary is taken in one pass, so episodes can be streamed from a payload.
+        count, final_steps, best_steps, final_reward = 0, None, None, None
+        for episode in episodes:
+            count += 1
+            final_steps, final_reward = len(episode["AverageRewards"]), sum(episode["AverageRewards"])
+            best_steps = final_steps if best_steps is None else min(best_steps, final_steps)
+
+        record: RunRecord = {
+            "Name": name,
+            "Params": params,
+            "Seed": params["Seed"],
+            "GridX": params["GridSize"]["X"],
+            "GridY": params["GridSize"]["Y"],
+            "AgentCount": params["AgentCount"],
+            "FoodCount": params["FoodCount"],
+            "ObstacleCount": params["ObstacleCount"],
+            "NestCount": params["NestCount"],
+            "MaxSteps": params["MaxSteps"],
+            "EpisodeCount": params["EpisodeCount"],
+            "ProximityRadius": params["ProximityRadius"],
+            "Hyperparams": hyperparams,
+            "Created": created if created is not None else time.time(),
+            "Episodes": count,
+            "FinalSteps": final_steps,
+            "BestSteps": best_steps,
+            "FinalReward": final_reward,
+            "Path": path,
+        }
+
+        row = dict(record, Params=json.dumps(params), Hyperparams=json.dumps(hyperparams))
+        with DataStoreFunctions.Registry() as connection:
+            connection.execute(
+                f"INSERT OR REPLACE INTO Runs ({', '.join(REGISTRY_COLUMNS)}) "
+                f"VALUES ({', '.join('?' for _ in REGISTRY_COLUMNS)})",
+                [row[column] for column in REGISTRY_COLUMNS],
+            )
+        connection.close()
+        return None
+
+    @staticmethod
+    def FindRuns(filters: Optional[Dict[str, Any]] = None, order_by: str = "Created", limit: Optional[int] = None) -> List[RunRecord]:
+        # Filters map column names to required values, e.g. {"GridX": 15, "GridY": 15}. Only the registry is read.
+        filters = filters or {}
+        for column in list(filters) + [order_by]:
+            if column not in REGISTRY_COLUMNS:
+                raise ValueError(f"Unknown registry column: {column}")
+
+        query = "SELECT * FROM Runs"
+        if filters:
+            query += " WHERE " + " AND ".join(f"{column} = ?" for column in filters)
+        query += f" ORDER BY {order_by} IS NULL, {order_by}"
+        if limit is not None:
+            query += f" LIMIT {int(limit)}"
+
+        connection = DataStoreFunctions.Registry()
+        rows = connection.execute(query, list(filters.values())).fetchall()
+        connection.close()
+        return [dict(row, Params=json.loads(row["Params"]), Hyperparams=json.loads(row["Hyperparams"] or "null")) for row in rows]
+
+    @staticmethod
+    def BestRun(filters: Optional[Dict[str, Any]] = None) -> Optional[RunRecord]:
+        # The run whose best episode took the fewest steps.
+        runs = DataStoreFunctions.FindRuns(filters, order_by="BestSteps", limit=1)
+        return runs[0] if runs else None
+
+    @staticmethod
+    def LoadRun(record: RunRecord) -> Tuple[Optional[List[PolicyLookup]], List[Episode]]:
+        # Runs saved with SaveTables have no lookups, their policies are opened with OpenTables.
+        data = DataStoreFunctions.Payload(record["Path"])
+        return data["Lookups"], data["Episodes"]
+
+    @staticmethod
+    def Reindex() -> int:
+        # Rebuilds the registry from the payloads in ../runs, streaming the episodes of each. Payloads saved without
+        # their params get them from their file name, and runs new to the registry are dated by their file.
+        count = 0
+        for name in os.listdir("../runs"):
+            if not name.endswith(".dill"):
+                continue
+
+            path = f"../runs/{name}"
+            data = next(data for data in DataStoreFunctions.Pickles(path) if not isinstance(data, list))
+
+            if "Params" in data:
+                params, hyperparams = data["Params"], data.get("Hyperparams")
+            else:
+                parsed = DataStoreFunctions.FileNameToParams(name[:-len(".dill")])
+                if parsed is None:
+                    continue
+                params, hyperparams = parsed
+
+            DataStoreFunctions.Register(params, DataStoreFunctions.Episodes(path), path, hyperparams, os.path.getmtime(path))
+            count += 1
+        return count
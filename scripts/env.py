@@ -1,4 +1,5 @@
-from math import floor, hypot
+from collections import deque
+from math import floor, hypot, ceil
 from typing import List, TypedDict, Literal, Callable, TypeVar, Optional, Tuple, Dict
 from pygame import Color, Surface
 from pygame.font import Font
@@ -6,6 +7,7 @@ from numpy.random import Generator, PCG64
 from vector import Vector2
 from scripts.event import Event, EventFunctions
 from tqdm import tqdm
+import numpy as np
 import pygame
 
 
@@ -35,11 +37,15 @@ NEST_IMAGE = "../images/icons8-egg-basket-48.png"
 FOOD_IMAGE = "../images/icons8-whole-apple-48.png"
 CARRIED_FOOD_IMAGE = "../images/icons8-whole-apple-carried-48.png"
 
+VIEWER_FPS = 10 # Steps per second while the viewer is running.
+VIEWER_WAIT_MS = 250 # How long a paused viewer blocks waiting for input before checking again.
+
 T = TypeVar("T")
 E = TypeVar("E")
 
 
 class Food(TypedDict):
+    Id: int
     Location: Vector2
     Status: Literal["Carried", "Deposited", "Dropped"]
     SpawnLocation: Vector2
@@ -80,6 +86,7 @@ class Env(TypedDict):
     EpisodeStarted: Event
     EpisodeEnded: Event
     ProximityDetected: Event
+    KeyPressed: Event
     Food: List[Food]
     Obstacles: List[Obstacle]
     Nests: List[Nest]
@@ -90,9 +97,15 @@ class Env(TypedDict):
     Font: Optional[Font]
     Running: bool
     CurrentStep: int
+    FoodDeposited: int
+    DepositedPrefix: int
+    DepositedSuffix: int
     MaxSteps: int
     EpisodeCount: int
     ProximityRadius: float
+    NestDistances: List[np.ndarray]
+    FoodDistances: List[np.ndarray]
+    OptimalSteps: int
 
 
 class EnvParams(TypedDict):
@@ -133,8 +146,9 @@ class EnvFunctions:
         }
 
     @staticmethod
-    def Food() -> Food:
+    def Food(key: int) -> Food:
         return {
+            "Id": key,
             "Location": {"X": 0, "Y": 0},
             "Status": "Dropped",
             "SpawnLocation": {"X": 0, "Y": 0},
@@ -157,7 +171,7 @@ class EnvFunctions:
         return {
             "Initialized": False,
             "Agents": [EnvFunctions.Agent(key) for key in range(params["AgentCount"])],
-            "Food": [EnvFunctions.Food() for _ in range(params["FoodCount"])],
+            "Food": [EnvFunctions.Food(key) for key in range(params["FoodCount"])],
             "Obstacles": [EnvFunctions.Obstacle() for _ in range(params["ObstacleCount"])],
             "Nests": [EnvFunctions.Nest() for _ in range(params["NestCount"])],
             "Generator": Generator(PCG64(params["Seed"])),
@@ -168,14 +182,21 @@ class EnvFunctions:
             "MaxStepReached": EventFunctions.Event(),
             "Rendered": EventFunctions.Event(),
             "ProximityDetected": EventFunctions.Event(),
+            "KeyPressed": EventFunctions.Event(),
             "EpisodeStarted": EventFunctions.Event(),
             "EpisodeEnded": EventFunctions.Event(),
             "GridSize": params["GridSize"],
             "Running": False,
             "CurrentStep": 0,
+            "FoodDeposited": 0,
+            "DepositedPrefix": 0,
+            "DepositedSuffix": 0,
             "MaxSteps": params["MaxSteps"],
             "EpisodeCount": params["EpisodeCount"],
             "ProximityRadius": params["ProximityRadius"],
+            "NestDistances": [],
+            "FoodDistances": [],
+            "OptimalSteps": 0,
             "WindowSize": {
                 "X": IMAGE_PIXEL_WIDTH * params["GridSize"]["X"],
                 "Y": IMAGE_PIXEL_WIDTH * params["GridSize"]["Y"]
@@ -234,29 +255,115 @@ class EnvFunctions:
             env["Initialized"] = True
             env["Window"] = pygame.display.set_mode((env["WindowSize"]["X"], env["WindowSize"]["Y"]))
             env["Font"] = pygame.font.SysFont("arialblack", 30)
+            EnvFunctions.Spawn(env)
+
+    @staticmethod
+    def Spawn(env: Env):
+        # Places every entity using the env generator. Envs built from the same params always get the same layout,
+        # which lets headless copies of an env (e.g. training workers) share a single set of policies.
+        for agent in env["Agents"]:
+            agent["SpawnLocation"] = EnvFunctions.GetEmptyLocation(env)
+            agent["Location"] = agent["SpawnLocation"]
+
+        for obstacle in env["Obstacles"]:
+            obstacle["SpawnLocation"] = EnvFunctions.GetEmptyLocation(env)
+            obstacle["Location"] = obstacle["SpawnLocation"]
+
+        for nest in env["Nests"]:
+            nest["SpawnLocation"] = EnvFunctions.GetEmptyLocation(env)
+            nest["Location"] = nest["SpawnLocation"]
+
+        for food in env["Food"]:
+            food["SpawnLocation"] = EnvFunctions.GetEmptyLocation(env)
+            food["Location"] = food["SpawnLocation"]
+
+        # Obstacles never move, so shortest path distances only need to be found once per layout.
+        env["NestDistances"] = [EnvFunctions.DistanceField(env, nest["SpawnLocation"]) for nest in env["Nests"]]
+        env["FoodDistances"] = [EnvFunctions.DistanceField(env, food["SpawnLocation"]) for food in env["Food"]]
+        env["OptimalSteps"] = EnvFunctions.OptimalSteps(env)
+
+    @staticmethod
+    def DistanceField(env: Env, source: Vector2) -> np.ndarray:
+        # Breadth first search from the source around obstacles. Each cell holds the fewest moves needed to reach
+        # the source from it, or -1 if it cannot be reached.
+        blocked = np.zeros((env["GridSize"]["X"], env["GridSize"]["Y"]), dtype=bool)
+        for obstacle in env["Obstacles"]:
+            blocked[obstacle["SpawnLocation"]["X"], obstacle["SpawnLocation"]["Y"]] = True
+
+        distances = np.full((env["GridSize"]["X"], env["GridSize"]["Y"]), -1, dtype=np.int32)
+        distances[source["X"], source["Y"]] = 0
+        queue = deque([(source["X"], source["Y"])])
+
+        while queue:
+            x, y = queue.popleft()
+            for action in AGENT_ACTIONS:
+                nx, ny = x + action["Direction"]["X"], y + action["Direction"]["Y"]
+                if 0 <= nx < env["GridSize"]["X"] and 0 <= ny < env["GridSize"]["Y"]:
+                    if distances[nx, ny] == -1 and not blocked[nx, ny]:
+                        distances[nx, ny] = distances[x, y] + 1
+                        queue.append((nx, ny))
+        return distances
 
-            for agent in env["Agents"]:
-                agent["SpawnLocation"] = EnvFunctions.GetEmptyLocation(env)
-                agent["Location"] = agent["SpawnLocation"]
+    @staticmethod
+    def NestDistance(env: Env, location: Vector2) -> int:
+        reachable = [int(field[location["X"], location["Y"]]) for field in env["NestDistances"]]
+        reachable = [distance for distance in reachable if distance >= 0]
+        return min(reachable) if reachable else -1
 
-            for obstacle in env["Obstacles"]:
-                obstacle["SpawnLocation"] = EnvFunctions.GetEmptyLocation(env)
-                obstacle["Location"] = obstacle["SpawnLocation"]
+    @staticmethod
+    def IsReachable(env: Env) -> bool:
+        # Every food has to be reachable by at least one agent and be able to be carried to a nest.
+        for food, field in zip(env["Food"], env["FoodDistances"]):
+            if EnvFunctions.NestDistance(env, food["SpawnLocation"]) < 0:
+                return False
+            if all(field[agent["SpawnLocation"]["X"], agent["SpawnLocation"]["Y"]] < 0 for agent in env["Agents"]):
+                return False
+        return True
 
-            for nest in env["Nests"]:
-                nest["SpawnLocation"] = EnvFunctions.GetEmptyLocation(env)
-                nest["Location"] = nest["SpawnLocation"]
+    @staticmethod
+    def OptimalSteps(env: Env) -> int:
+        # A cheap lower bound on the steps needed to deposit all food. Every food costs at least a round trip from the
+        # nest, except that each agent's first trip starts from its spawn instead, and the work is assumed to split
+        # evenly between the agents. No single food can be deposited faster than its closest agent can walk to it and
+        # then to the nest.
+        if len(env["Food"]) == 0 or not EnvFunctions.IsReachable(env):
+            return 0
+
+        trips, savings, longest = 0, [], 0
+        for food, field in zip(env["Food"], env["FoodDistances"]):
+            to_nest = EnvFunctions.NestDistance(env, food["SpawnLocation"])
+            to_agent = min(
+                int(field[agent["SpawnLocation"]["X"], agent["SpawnLocation"]["Y"]])
+                for agent in env["Agents"]
+                if field[agent["SpawnLocation"]["X"], agent["SpawnLocation"]["Y"]] >= 0
+            )
+            trips += 2 * to_nest
+            savings.append(to_agent - to_nest)
+            longest = max(longest, to_agent + to_nest)
 
-            for food in env["Food"]:
-                food["SpawnLocation"] = EnvFunctions.GetEmptyLocation(env)
-                food["Location"] = food["SpawnLocation"]
+        # Some agent has to make the first trip. Every other agent makes at most one and only does so if it helps.
+        savings.sort()
+        first = savings[0] + sum(min(0, saving) for saving in savings[1:len(env["Agents"])])
+        return max(longest, ceil((trips + first) / len(env["Agents"])))
+
+    @staticmethod
+    def Efficiency(env: Env) -> float:
+        # How close the last episode came to the optimal baseline, where 1 is optimal.
+        if not EnvFunctions.AllDeposited(env) or env["CurrentStep"] == 0:
+            return 0.00
+        return env["OptimalSteps"] / env["CurrentStep"]
 
     @staticmethod
     def Reset(env: Env):
         env["CurrentStep"] = 0
+        env["FoodDeposited"] = 0
+        env["DepositedPrefix"] = 0
+        env["DepositedSuffix"] = 0
 
+        # Episodes cut off at MaxSteps end with food still carried, which is dropped back at its spawn below.
         for agent in env["Agents"]:
             agent["Location"] = agent["SpawnLocation"]
+            agent["Food"].clear()
 
         for obstacle in env["Obstacles"]:
             obstacle["Location"] = obstacle["SpawnLocation"]
@@ -323,6 +430,14 @@ class EnvFunctions:
         if EnvFunctions.CanDeposit(env, agent, food):
             food["Status"] = "Deposited"
             agent["Food"].remove(food)
+            env["FoodDeposited"] += 1
+
+            # Track how many food at the start and end of the food list are all deposited. Each food is passed over
+            # at most once per episode, so ordered pickup rules can be checked in constant time.
+            while env["DepositedPrefix"] < len(env["Food"]) and env["Food"][env["DepositedPrefix"]]["Status"] == "Deposited":
+                env["DepositedPrefix"] += 1
+            while env["DepositedSuffix"] < len(env["Food"]) and env["Food"][-1 - env["DepositedSuffix"]]["Status"] == "Deposited":
+                env["DepositedSuffix"] += 1
             return True
         return False
 
@@ -428,10 +543,7 @@ class EnvFunctions:
 
     @staticmethod
     def AllDeposited(env: Env):
-        for food in env["Food"]:
-            if food["Status"] != "Deposited":
-                return False
-        return True
+        return env["FoodDeposited"] >= len(env["Food"])
 
     @staticmethod
     def TryMoveAgent(env: Env, agent: Agent, action: int) -> bool:
@@ -452,15 +564,10 @@ class EnvFunctions:
 
     @staticmethod
     def GetState(env: Env) -> EnvState:
-        deposited = 0
-        for food in env["Food"]:
-            if food["Status"] == "Deposited":
-                deposited += 1
-
         return {
             "AgentLocations": [agent["Location"] for agent in env["Agents"]],
             "CarryingFood": [len(agent["Food"]) > 0 for agent in env["Agents"]],
-            "FoodDeposited": deposited,
+            "FoodDeposited": env["FoodDeposited"],
         }
 
     @staticmethod
@@ -484,6 +591,8 @@ class EnvFunctions:
                     EventFunctions.Fire(env["ProximityDetected"], {
                         "Agent1": agent1,
                         "Agent2": agent2,
+                        "Index1": index1,
+                        "Index2": index2,
                     })
 
     @staticmethod
@@ -526,14 +635,15 @@ class EnvFunctions:
             pygame.display.flip()
 
     @staticmethod
-    def RunTrain(env: Env):
+    def RunTrain(env: Env, start_episode: int = 0):
+        # Training resumed from a checkpoint starts at the episode after the checkpoint.
         env["Running"] = True
         EnvFunctions.Reset(env)
         EnvFunctions.RenderFrame(env)
 
-        progress_bar = tqdm(total=env["EpisodeCount"])
+        progress_bar = tqdm(total=env["EpisodeCount"], initial=start_episode)
 
-        for episode in range(env["EpisodeCount"]):
+        for episode in range(start_episode, env["EpisodeCount"]):
             EnvFunctions.Reset(env)
             EventFunctions.Fire(env["EpisodeStarted"], {
                 "Episode": episode,
@@ -551,30 +661,72 @@ class EnvFunctions:
                 "Episode": episode,
             })
 
+            progress_bar.set_postfix(Efficiency=f"{EnvFunctions.Efficiency(env):.2f}")
             progress_bar.update(1)
 
+            # Stop early if the window was closed or a callback ended training.
+            if not env["Running"]:
+                break
+
         progress_bar.close()
 
+    @staticmethod
+    def RunEpisode(env: Env, episode: int):
+        # Runs a single episode without pygame. Unlike RunTrain, the episode is cut off after MaxSteps.
+        EnvFunctions.Reset(env)
+        EventFunctions.Fire(env["EpisodeStarted"], {
+            "Episode": episode,
+        })
+
+        while not EnvFunctions.AllDeposited(env) and env["Running"] and env["CurrentStep"] < env["MaxSteps"]:
+            EnvFunctions.Step(env)
+
+        EventFunctions.Fire(env["EpisodeEnded"], {
+            "Episode": episode,
+        })
+
     @staticmethod
     def RunTest(env: Env):
+        # SPACE runs or pauses the simulation and RIGHT advances it by a single step. While paused the loop blocks
+        # waiting for input, and while running it is capped at VIEWER_FPS, so an open viewer leaves the CPU idle.
         env["Running"] = True
         EnvFunctions.Reset(env)
         EnvFunctions.RenderFrame(env)
 
+        clock = pygame.time.Clock()
+        paused = True
+
         while env["Running"] and pygame.get_init():
-            if pygame.key.get_pressed()[pygame.K_SPACE]:
+            step = not paused
+            events = [pygame.event.wait(VIEWER_WAIT_MS)] if paused else pygame.event.get()
+
+            for event in events:
+                if event.type == pygame.QUIT:
+                    env["Running"] = False
+                elif event.type == pygame.KEYDOWN and event.key == pygame.K_SPACE:
+                    paused = not paused
+                elif event.type == pygame.KEYDOWN and event.key == pygame.K_RIGHT:
+                    paused, step = True, True
+                elif event.type == pygame.KEYDOWN:
+                    # Other keys are left to listeners, e.g. to change an overlay, and the frame is redrawn.
+                    EventFunctions.Fire(env["KeyPressed"], {
+                        "Key": event.key,
+                    })
+                    EnvFunctions.RenderFrame(env)
+
+            if not env["Running"]:
+                EnvFunctions.Close()
+                break
+
+            if step:
                 if EnvFunctions.AllDeposited(env):
                     EnvFunctions.Reset(env)
 
                 EnvFunctions.Step(env)
                 EnvFunctions.RenderFrame(env)
 
-                pygame.time.delay(100)
-
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    env["Running"] = False
-                    EnvFunctions.Close()
+            if not paused:
+                clock.tick(VIEWER_FPS)
 
     @staticmethod
     def Close():
@@ -1,4 +1,4 @@
-from typing import TypedDict, List
+from typing import TypedDict, List, Iterable
 from matplotlib import pyplot as plt
 
 
@@ -16,9 +16,9 @@ class EpisodeFunctions:
         }
 
     @staticmethod
-    def PlotRewards(episodes: List[Episode]):
-        x = [index for index in range(len(episodes))]
+    def PlotRewards(episodes: Iterable[Episode]):
         y = [sum(episode["AverageRewards"]) for episode in episodes]
+        x = [index for index in range(len(y))]
         plt.plot(x, y)
         plt.title("Rewards per Episode")
         plt.ylabel("Reward")
@@ -26,11 +26,21 @@ class EpisodeFunctions:
         plt.show()
 
     @staticmethod
-    def PlotSteps(episodes: List[Episode]):
-        x = [index for index in range(len(episodes))]
+    def PlotSteps(episodes: Iterable[Episode]):
         y = [len(episode["AverageRewards"]) for episode in episodes]
+        x = [index for index in range(len(y))]
         plt.plot(x, y)
         plt.title("Steps per Episode")
         plt.ylabel("Steps")
         plt.xlabel(f"Episode")
+        plt.show()
+
+    @staticmethod
+    def PlotEfficiency(episodes: Iterable[Episode], optimal_steps: int):
+        y = [optimal_steps / max(1, len(episode["AverageRewards"])) for episode in episodes]
+        x = [index for index in range(len(y))]
+        plt.plot(x, y)
+        plt.title("Efficiency per Episode")
+        plt.ylabel("Optimal Steps / Steps")
+        plt.xlabel(f"Episode")
         plt.show()
\ No newline at end of file
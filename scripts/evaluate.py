@@ -0,0 +1,94 @@
+from typing import TypedDict, List, Any
+from scripts.env import EnvFunctions, Env, EnvParams
+from scripts.event import EventFunctions
+from scripts.qtable import QTableFunctions, QTable
+from scripts.rules import RuleFunctions, Rule
+
+
+class Evaluation(TypedDict):
+    Episode: int
+    Steps: List[int]
+    SuccessRate: float
+    Efficiency: float
+
+
+class Evaluator(TypedDict):
+    Env: Env
+    Interval: int
+    EpisodeCount: int
+    TargetSuccessRate: float
+    TargetEfficiency: float
+    Patience: int
+    Streak: int
+    Evaluations: List[Evaluation]
+
+
+class EvaluationFunctions:
+    @staticmethod
+    def Evaluator(
+            params: EnvParams,
+            interval: int = 10,
+            episode_count: int = 1,
+            target_success_rate: float = 1.00,
+            target_efficiency: float = 0.50,
+            patience: int = 3,
+    ) -> Evaluator:
+        # The evaluator keeps its own headless copy of the env, so evaluating never disturbs the env being trained.
+        env = EnvFunctions.Env(params)
+        EnvFunctions.Spawn(env)
+        env["Running"] = True
+
+        return {
+            "Env": env,
+            "Interval": interval,
+            "EpisodeCount": episode_count,
+            "TargetSuccessRate": target_success_rate,
+            "TargetEfficiency": target_efficiency,
+            "Patience": patience,
+            "Streak": 0,
+            "Evaluations": [],
+        }
+
+    @staticmethod
+    def Evaluate(
+            evaluator: Evaluator,
+            tables: List[QTable],
+            rules: List[Rule],
+            episode: int,
+    ) -> Evaluation:
+        # Runs greedy (epsilon = 0) episodes without rendering and records how long each took to deposit all food.
+        env = evaluator["Env"]
+
+        def on_step_started(message: Any):
+            for index, agent in enumerate(env["Agents"]):
+                table = QTableFunctions.ForAgent(tables, index)
+                agent["LastAction"] = QTableFunctions.GetAction(table, index, env["Generator"], message["State"], 0)
+                RuleFunctions.UpdateAgent(env, rules[index], agent, agent["LastAction"])
+
+        EventFunctions.Connect(env["StepStarted"], on_step_started)
+        steps, successes, efficiency = [], 0, 0.00
+        for index in range(evaluator["EpisodeCount"]):
+            EnvFunctions.RunEpisode(env, index)
+            steps.append(env["CurrentStep"])
+            if EnvFunctions.AllDeposited(env):
+                successes += 1
+                efficiency += EnvFunctions.Efficiency(env)
+        EventFunctions.Disconnect(env["StepStarted"], on_step_started)
+
+        evaluation: Evaluation = {
+            "Episode": episode,
+            "Steps": steps,
+            "SuccessRate": successes / evaluator["EpisodeCount"],
+            "Efficiency": efficiency / successes if successes > 0 else 0.00,
+        }
+        evaluator["Evaluations"].append(evaluation)
+        return evaluation
+
+    @staticmethod
+    def ShouldStop(evaluator: Evaluator, evaluation: Evaluation) -> bool:
+        # Training can stop once the greedy policy has held the target quality for Patience evaluations in a row.
+        if evaluation["SuccessRate"] >= evaluator["TargetSuccessRate"] and evaluation["Efficiency"] >= evaluator["TargetEfficiency"]:
+            evaluator["Streak"] += 1
+        else:
+            evaluator["Streak"] = 0
+        return evaluator["Streak"] >= evaluator["Patience"]
@@ -0,0 +1,105 @@
+from typing import TypedDict, List, Optional, Tuple
+from scripts.env import EnvFunctions, Env, EnvParams
+from scripts.rules import RuleFunctions, Rule
+import numpy as np
+
+
+# Channels of the grid observation, each a Row -> Column grid of counts.
+CHANNELS = ("Agents", "CarryingAgents", "Food", "Obstacles", "Nests")
+
+
+class GymEnv(TypedDict):
+    Params: EnvParams
+    Seed: int
+    Env: Optional[Env]
+    Rules: List[Rule]
+    Observations: np.ndarray # Channel -> Row -> Column
+    Rewards: np.ndarray
+    Terminated: np.ndarray
+    Truncated: np.ndarray
+
+
+class GymFunctions:
+    @staticmethod
+    def GymEnv(params: EnvParams, rules: Optional[List[Rule]] = None) -> GymEnv:
+        # Wraps an env in a reset/step interface for external trainers. Observations, rewards, terminated and
+        # truncated are preallocated once and refilled in place on every step, so the returned arrays are views
+        # that are overwritten by the next call.
+        agent_count = params["AgentCount"]
+        gym: GymEnv = {
+            "Params": params,
+            "Seed": params["Seed"],
+            "Env": None, # Built below.
+            "Rules": rules if rules is not None else [RuleFunctions.Rule() for _ in range(agent_count)],
+            "Observations": np.zeros((len(CHANNELS), params["GridSize"]["X"], params["GridSize"]["Y"]), dtype=np.float32),
+            "Rewards": np.zeros(agent_count, dtype=np.float64),
+            "Terminated": np.zeros(agent_count, dtype=bool),
+            "Truncated": np.zeros(agent_count, dtype=bool),
+        }
+        GymFunctions.Build(gym, params["Seed"])
+        return gym
+
+    @staticmethod
+    def Build(gym: GymEnv, seed: int) -> None:
+        # Creates a fresh env for the seed, so the same seed always produces the same layout.
+        env = EnvFunctions.Env(dict(gym["Params"], Seed=seed))
+        EnvFunctions.Spawn(env)
+        env["Running"] = True
+        gym["Env"] = env
+        gym["Seed"] = seed
+
+        # Obstacles and nests never move, so their channels are only filled when the layout changes.
+        observations = gym["Observations"]
+        observations[CHANNELS.index("Obstacles")] = 0
+        observations[CHANNELS.index("Nests")] = 0
+        for obstacle in env["Obstacles"]:
+            observations[CHANNELS.index("Obstacles"), obstacle["Location"]["X"], obstacle["Location"]["Y"]] += 1
+        for nest in env["Nests"]:
+            observations[CHANNELS.index("Nests"), nest["Location"]["X"], nest["Location"]["Y"]] += 1
+        return None
+
+    @staticmethod
+    def Observe(gym: GymEnv) -> None:
+        env, observations = gym["Env"], gym["Observations"]
+        observations[:CHANNELS.index("Obstacles")] = 0
+
+        for agent in env["Agents"]:
+            observations[CHANNELS.index("Agents"), agent["Location"]["X"], agent["Location"]["Y"]] += 1
+            if len(agent["Food"]) > 0:
+                observations[CHANNELS.index("CarryingAgents"), agent["Location"]["X"], agent["Location"]["Y"]] += 1
+
+        for food in env["Food"]:
+            if food["Status"] == "Dropped":
+                observations[CHANNELS.index("Food"), food["Location"]["X"], food["Location"]["Y"]] += 1
+        return None
+
+    @staticmethod
+    def Reset(gym: GymEnv, seed: Optional[int] = None) -> np.ndarray:
+        if seed is not None and seed != gym["Seed"]:
+            GymFunctions.Build(gym, seed)
+
+        EnvFunctions.Reset(gym["Env"])
+        gym["Rewards"][:] = 0
+        gym["Terminated"][:] = False
+        gym["Truncated"][:] = False
+        GymFunctions.Observe(gym)
+        return gym["Observations"]
+
+    @staticmethod
+    def Step(gym: GymEnv, actions: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        # Takes one action per agent and returns (observations, rewards, terminated, truncated). The env is advanced
+        # directly instead of through EnvFunctions.Step, which skips building states and firing events that nothing
+        # listens to here, so rewards go straight into their buffer.
+        env = gym["Env"]
+        for index, agent in enumerate(env["Agents"]):
+            agent["LastAction"] = int(actions[index])
+            gym["Rewards"][index] = RuleFunctions.UpdateAgent(env, gym["Rules"][index], agent, agent["LastAction"])
+
+        EnvFunctions.UpdateCarriedFoodLocations(env)
+        env["CurrentStep"] += 1
+        GymFunctions.Observe(gym)
+
+        terminated = EnvFunctions.AllDeposited(env)
+        gym["Terminated"][:] = terminated
+        gym["Truncated"][:] = not terminated and env["CurrentStep"] >= env["MaxSteps"]
+        return gym["Observations"], gym["Rewards"], gym["Terminated"], gym["Truncated"]
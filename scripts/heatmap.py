@@ -0,0 +1,36 @@
+from typing import Optional
+from matplotlib import colormaps
+from pygame import Surface
+from scripts.env import IMAGE_PIXEL_WIDTH
+from scripts.qtable import QTable
+from vector import Vector2
+import numpy as np
+import pygame
+
+
+class HeatmapFunctions:
+    @staticmethod
+    def ColorMap(name: str = "viridis") -> np.ndarray:
+        # A lookup table of 256 RGB colors, so mapping values to colors is a single indexing operation.
+        return (colormaps[name](np.linspace(0.00, 1.00, 256))[:, :3] * 255).astype(np.uint8)
+
+    @staticmethod
+    def Values(table: QTable, layer: int, size: Vector2, action: Optional[int] = None) -> np.ndarray:
+        # The max QValue (or the QValue of one action) of every cell in a layer, as a Row -> Column array.
+        values = table["Values"][layer]
+        values = values.max(axis=-1) if action is None else values[..., action]
+        values = np.repeat(np.repeat(values, table["TileSize"], axis=0), table["TileSize"], axis=1)
+        return values[:size["X"], :size["Y"]]
+
+    @staticmethod
+    def Draw(surface: Surface, values: np.ndarray, color_map: np.ndarray, alpha: int = 160) -> None:
+        # Normalizes the values, colors them through the lookup table and blits the result scaled up to the grid.
+        low, high = float(values.min()), float(values.max())
+        scale = (len(color_map) - 1) / (high - low) if high > low else 0.00
+        indices = ((values - low) * scale).astype(np.intp)
+
+        heatmap = pygame.surfarray.make_surface(color_map[indices])
+        heatmap = pygame.transform.scale(heatmap, (values.shape[0] * IMAGE_PIXEL_WIDTH, values.shape[1] * IMAGE_PIXEL_WIDTH))
+        heatmap.set_alpha(alpha)
+        surface.blit(heatmap, (0, 0))
+        return None
@@ -0,0 +1,168 @@
+from typing import TypedDict, List, Optional, Dict, Iterator
+from scripts.datastore import DataStoreFunctions
+from scripts.env import Env, EnvParams
+from scripts.episode import Episode
+from scripts.qtable import QTableFunctions, QTable
+import numpy as np
+import tracemalloc
+import shutil
+import dill
+import sys
+import os
+
+
+class MemoryReport(TypedDict):
+    QTables: int
+    Episodes: int
+    Env: int
+    Surfaces: int
+    Total: int
+    Traced: Optional[int]
+    TracedPeak: Optional[int]
+
+
+class MemoryBudget(TypedDict):
+    TableBytes: Optional[int] # Largest allowed size of the QTables, checked before training starts.
+    EpisodeBytes: Optional[int] # Episodes held in memory beyond this are spilled to disk.
+
+
+class MemoryFunctions:
+    @staticmethod
+    def MemoryBudget(table_bytes: Optional[int] = None, episode_bytes: Optional[int] = None) -> MemoryBudget:
+        return {
+            "TableBytes": table_bytes,
+            "EpisodeBytes": episode_bytes,
+        }
+
+    @staticmethod
+    def TableBytes(tables: List[QTable]) -> int:
+        return sum(table["Values"].nbytes for table in tables)
+
+    @staticmethod
+    def EpisodeBytes(episode: Episode) -> int:
+        # Per step metrics are lists of python numbers, each of which is its own object.
+        return sys.getsizeof(episode) + sum(
+            sys.getsizeof(values) + sum(sys.getsizeof(value) for value in values)
+            for values in episode.values()
+        )
+
+    @staticmethod
+    def EnvBytes(env: Env) -> int:
+        entities = env["Agents"] + env["Food"] + env["Obstacles"] + env["Nests"]
+        return sum(sys.getsizeof(entity) for entity in entities) + sum(
+            field.nbytes for field in env["NestDistances"] + env["FoodDistances"]
+        )
+
+    @staticmethod
+    def SurfaceBytes(env: Env) -> int:
+        # Only the window is kept between frames, images are loaded when they are drawn.
+        window = env.get("Window")
+        if window is None:
+            return 0
+        return window.get_width() * window.get_height() * window.get_bytesize()
+
+    @staticmethod
+    def Report(env: Env, tables: List[QTable], episodes: List[Episode]) -> MemoryReport:
+        report: MemoryReport = {
+            "QTables": MemoryFunctions.TableBytes(tables),
+            "Episodes": sum(MemoryFunctions.EpisodeBytes(episode) for episode in episodes),
+            "Env": MemoryFunctions.EnvBytes(env),
+            "Surfaces": MemoryFunctions.SurfaceBytes(env),
+            "Total": 0,
+            "Traced": None,
+            "TracedPeak": None,
+        }
+        report["Total"] = report["QTables"] + report["Episodes"] + report["Env"] + report["Surfaces"]
+
+        if tracemalloc.is_tracing():
+            report["Traced"], report["TracedPeak"] = tracemalloc.get_traced_memory()
+        return report
+
+    @staticmethod
+    def Format(report: MemoryReport) -> str:
+        lines = []
+        for key, value in report.items():
+            if value is not None:
+                lines.append(f"{key}: {value / 2 ** 20:.2f} MiB")
+        return "\n".join(lines)
+
+    @staticmethod
+    def StartTracing(frames: int = 1) -> None:
+        # Tracing slows allocation down noticeably, so it is only started on request.
+        tracemalloc.start(frames)
+        return None
+
+    @staticmethod
+    def TopAllocations(limit: int = 10) -> List[str]:
+        snapshot = tracemalloc.take_snapshot()
+        return [str(statistic) for statistic in snapshot.statistics("lineno")[:limit]]
+
+    @staticmethod
+    def EstimateTableBytes(params: EnvParams, tile_size: int = 1, shared: bool = False) -> int:
+        # What training the params will allocate for policies: a QTable per agent, or just one if shared. Tile
+        # coding adds a table at tile resolution to each.
+        table = int(np.prod(QTableFunctions.Shape(params["GridSize"], params["FoodCount"]))) * np.dtype(np.float64).itemsize
+        if tile_size > 1:
+            table += int(np.prod(QTableFunctions.Shape(params["GridSize"], params["FoodCount"], tile_size))) * np.dtype(np.float64).itemsize
+        return (1 if shared else params["AgentCount"]) * table
+
+    @staticmethod
+    def CheckBudget(params: EnvParams, budget: MemoryBudget, tile_size: int = 1, shared: bool = False) -> None:
+        # Refuses a configuration before anything is allocated instead of running out of memory part way through.
+        if budget["TableBytes"] is None:
+            return None
+
+        estimate = MemoryFunctions.EstimateTableBytes(params, tile_size, shared)
+        if estimate > budget["TableBytes"]:
+            raise MemoryError(
+                f"Policies for these params need about {estimate / 2 ** 20:.2f} MiB, "
+                f"over the budget of {budget['TableBytes'] / 2 ** 20:.2f} MiB."
+            )
+        return None
+
+    @staticmethod
+    def SpillDirectory(params: EnvParams, hyperparams: Optional[Dict[str, float]] = None) -> str:
+        return f"../runs/spill/{DataStoreFunctions.RunName(params, hyperparams)}"
+
+    @staticmethod
+    def Spill(params: EnvParams, episodes: List[Episode], offset: int, hyperparams: Optional[Dict[str, float]] = None) -> None:
+        # Writes episodes to disk as a chunk named by the index of its first episode.
+        directory = MemoryFunctions.SpillDirectory(params, hyperparams)
+        os.makedirs(name=directory, exist_ok=True)
+        with open(f"{directory}/{offset:08d}.dill.tmp", "wb") as file:
+            dill.dump(episodes, file)
+        os.replace(f"{directory}/{offset:08d}.dill.tmp", f"{directory}/{offset:08d}.dill")
+        return None
+
+    @staticmethod
+    def Truncate(params: EnvParams, count: int, hyperparams: Optional[Dict[str, float]] = None) -> None:
+        # Removes chunks starting at or after count, e.g. ones written after the checkpoint a run resumes from.
+        directory = MemoryFunctions.SpillDirectory(params, hyperparams)
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                if name.endswith(".dill") and int(name.split(".")[0]) >= count:
+                    os.remove(f"{directory}/{name}")
+        return None
+
+    @staticmethod
+    def Chunks(params: EnvParams, count: int, hyperparams: Optional[Dict[str, float]] = None) -> Iterator[List[Episode]]:
+        # Reads back the first count spilled episodes one chunk at a time, so they can be saved without holding all
+        # of them in memory. A chunk overlapped by the next one only keeps its episodes before the overlap.
+        directory = MemoryFunctions.SpillDirectory(params, hyperparams)
+        if not os.path.isdir(directory):
+            return
+
+        names = sorted(name for name in os.listdir(directory) if name.endswith(".dill"))
+        offsets = [int(name.split(".")[0]) for name in names] + [count]
+        for index, name in enumerate(names):
+            end = min(offsets[index + 1], count)
+            if end <= offsets[index]:
+                continue
+            with open(f"{directory}/{name}", "rb") as file:
+                yield dill.load(file)[:end - offsets[index]]
+
+    @staticmethod
+    def RemoveSpill(params: EnvParams, hyperparams: Optional[Dict[str, float]] = None) -> None:
+        # Spilled chunks are copied into the payload when a run is saved, after which they are no longer needed.
+        shutil.rmtree(MemoryFunctions.SpillDirectory(params, hyperparams), ignore_errors=True)
+        return None
@@ -0,0 +1,190 @@
+from multiprocessing import Pool
+from multiprocessing.shared_memory import SharedMemory
+from typing import List, Any, Optional, Dict
+from numpy.random import Generator, PCG64
+from scripts.env import EnvFunctions, Env, EnvParams
+from scripts.event import EventFunctions
+from scripts.episode import Episode, EpisodeFunctions
+from scripts.policy import DISCOUNT_FACTOR, LEARNING_RATE
+from scripts.qtable import QTableFunctions, QTable
+from scripts.rules import RuleFunctions, Rule
+import numpy as np
+import signal
+
+
+# Workers decay epsilon towards different floors so that some keep exploring while others exploit.
+MAX_EPSILON_FLOOR = 0.10
+
+
+class ParallelWorker:
+    Actions: List[int] = []
+    Rewards: List[float] = []
+    Epsilon: float = 1
+    EpsilonFloor: float
+    DecayRate: float
+    DiscountFactor: float
+    LearningRate: float
+    Tables: List[QTable]
+    Episodes: List[Episode]
+    CurrentEpisode: Episode
+    Rules: List[Rule]
+    Env: Env
+
+    @staticmethod
+    def OnStepStarted(message: Any):
+        ParallelWorker.Actions.clear()
+        ParallelWorker.Rewards.clear()
+
+        for index, agent in enumerate(ParallelWorker.Env["Agents"]):
+            action = QTableFunctions.GetAction(
+                table=QTableFunctions.ForAgent(ParallelWorker.Tables, index),
+                agent_index=index,
+                generator=ParallelWorker.Env["Generator"],
+                state=message["State"],
+                epsilon=ParallelWorker.Epsilon,
+            )
+            ParallelWorker.Actions.append(action)
+            ParallelWorker.Rewards.append(RuleFunctions.UpdateAgent(ParallelWorker.Env, ParallelWorker.Rules[index], agent, action))
+            agent["LastAction"] = action
+
+    @staticmethod
+    def OnStepEnded(message: Any):
+        # A table shared by every agent is updated by all of them in one batch.
+        if len(ParallelWorker.Tables) == 1:
+            QTableFunctions.UpdatePolicies(
+                table=ParallelWorker.Tables[0],
+                old_state=message["OldState"],
+                new_state=message["NewState"],
+                actions=ParallelWorker.Actions,
+                rewards=ParallelWorker.Rewards,
+                discount_factor=ParallelWorker.DiscountFactor,
+                learning_rate=ParallelWorker.LearningRate,
+            )
+
+        else:
+            for index, _ in enumerate(ParallelWorker.Env["Agents"]):
+                QTableFunctions.UpdatePolicy(
+                    table=QTableFunctions.ForAgent(ParallelWorker.Tables, index),
+                    agent_index=index,
+                    old_state=message["OldState"],
+                    new_state=message["NewState"],
+                    action=ParallelWorker.Actions[index],
+                    reward=ParallelWorker.Rewards[index],
+                    discount_factor=ParallelWorker.DiscountFactor,
+                    learning_rate=ParallelWorker.LearningRate,
+                )
+
+        ParallelWorker.CurrentEpisode["AverageRewards"].append(sum(ParallelWorker.Rewards))
+        ParallelWorker.Epsilon = max(ParallelWorker.EpsilonFloor, ParallelWorker.Epsilon - ParallelWorker.DecayRate)
+
+    @staticmethod
+    def OnEpisodeEnded(message: Any):
+        ParallelWorker.Episodes.append(ParallelWorker.CurrentEpisode)
+        ParallelWorker.CurrentEpisode = EpisodeFunctions.Episode()
+
+
+class ParallelFunctions:
+    @staticmethod
+    def InitWorker() -> None:
+        # Workers are forked from a process that may have pygame initialized, whose SIGTERM handler queues a QUIT
+        # event instead of exiting. The pool stops its workers with SIGTERM, so they get the default handler back.
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        return None
+
+    @staticmethod
+    def Worker(
+            params: EnvParams,
+            memory_name: str,
+            table_count: int,
+            tile_size: int,
+            worker_index: int,
+            worker_count: int,
+            episode_count: int,
+            rules: List[Rule],
+            hyperparams: Dict[str, float],
+    ) -> List[Episode]:
+        memory = SharedMemory(name=memory_name)
+
+        try:
+            shape = (table_count,) + QTableFunctions.Shape(params["GridSize"], params["FoodCount"], tile_size)
+            values = np.ndarray(shape, dtype=np.float64, buffer=memory.buf)
+
+            # Every worker builds the same layout from the params seed, then switches to its own random stream.
+            env = EnvFunctions.Env(params)
+            EnvFunctions.Spawn(env)
+            env["Generator"] = Generator(PCG64(params["Seed"]).jumped(worker_index + 1))
+            env["Running"] = True
+
+            ParallelWorker.Env = env
+            ParallelWorker.Tables = [
+                QTableFunctions.QTable(params["GridSize"], params["FoodCount"], values[index], tile_size)
+                for index in range(table_count)
+            ]
+            ParallelWorker.Episodes = []
+            ParallelWorker.CurrentEpisode = EpisodeFunctions.Episode()
+            ParallelWorker.Rules = rules
+            ParallelWorker.Epsilon = 1
+            ParallelWorker.EpsilonFloor = MAX_EPSILON_FLOOR * worker_index / max(1, worker_count - 1)
+            ParallelWorker.DecayRate = hyperparams.get("DecayRate", 1 / max(1, episode_count))
+            ParallelWorker.DiscountFactor = hyperparams.get("DiscountFactor", DISCOUNT_FACTOR)
+            ParallelWorker.LearningRate = hyperparams.get("LearningRate", LEARNING_RATE)
+
+            EventFunctions.Connect(env["StepStarted"], ParallelWorker.OnStepStarted)
+            EventFunctions.Connect(env["StepEnded"], ParallelWorker.OnStepEnded)
+            EventFunctions.Connect(env["EpisodeEnded"], ParallelWorker.OnEpisodeEnded)
+
+            for episode in range(episode_count):
+                EnvFunctions.RunEpisode(env, episode)
+
+            # Drop the views before closing, the buffer cannot be released while they exist.
+            del values
+            ParallelWorker.Tables = []
+            return ParallelWorker.Episodes
+
+        finally:
+            memory.close()
+
+    @staticmethod
+    def RunTrain(
+            params: EnvParams,
+            tables: List[QTable],
+            worker_count: int,
+            rules: List[Rule],
+            hyperparams: Optional[Dict[str, float]] = None,
+    ) -> List[Episode]:
+        # Hogwild-style training: every worker steps its own env copy and writes into the same shared QTables without
+        # locks. The trained values are copied back into the tables. A single table is shared by every agent.
+        shape = (len(tables),) + tables[0]["Values"].shape
+        memory = SharedMemory(create=True, size=int(np.prod(shape)) * np.dtype(np.float64).itemsize)
+
+        try:
+            values = np.ndarray(shape, dtype=np.float64, buffer=memory.buf)
+            for index, table in enumerate(tables):
+                values[index] = table["Values"]
+
+            counts = [params["EpisodeCount"] // worker_count] * worker_count
+            for index in range(params["EpisodeCount"] % worker_count):
+                counts[index] += 1
+
+            with Pool(processes=worker_count, initializer=ParallelFunctions.InitWorker) as pool:
+                results = pool.starmap(ParallelFunctions.Worker, [
+                    (params, memory.name, len(tables), tables[0]["TileSize"], index, worker_count, counts[index], rules, hyperparams or {})
+                    for index in range(worker_count)
+                ])
+
+            for index, table in enumerate(tables):
+                table["Values"][...] = values[index]
+
+            # Workers run side by side, so their episodes are interleaved in the order they happened instead of being
+            # grouped by worker.
+            del values
+            return [
+                episodes[index]
+                for index in range(max(counts))
+                for episodes in results
+                if index < len(episodes)
+            ]
+
+        finally:
+            memory.close()
+            memory.unlink()
@@ -0,0 +1,175 @@
+from math import ceil
+from typing import TypedDict, Tuple, Optional, List, Union
+import numpy as np
+from numpy.random import Generator
+from scripts.env import EnvState, AGENT_ACTIONS
+from scripts.policy import PolicyLookup, DISCOUNT_FACTOR, LEARNING_RATE
+from vector import Vector2
+
+
+class QTable(TypedDict):
+    Values: np.ndarray # Layer -> Row -> Column -> Action
+    FoodCount: int
+    TileSize: int
+
+
+class QTableFunctions:
+    @staticmethod
+    def Shape(size: Vector2, food_count: int, tile_size: int = 1) -> Tuple[int, int, int, int]:
+        # A QTable stores the same policies as a PolicyLookup in one dense array. Layers 0 to food_count are the
+        # NoFood grids (indexed by food deposited) and the last layer is the HasFood grid. With a tile size above 1,
+        # each square tile of cells shares one set of QValues, which shrinks the table and lets what is learned in
+        # one cell generalize to its neighbours.
+        return food_count + 2, ceil(size["X"] / tile_size), ceil(size["Y"] / tile_size), len(AGENT_ACTIONS)
+
+    @staticmethod
+    def QTable(size: Vector2, food_count: int, values: Optional[np.ndarray] = None, tile_size: int = 1) -> QTable:
+        if values is None:
+            values = np.zeros(QTableFunctions.Shape(size, food_count, tile_size), dtype=np.float64)
+        return {
+            "Values": values,
+            "FoodCount": food_count,
+            "TileSize": tile_size,
+        }
+
+    @staticmethod
+    def Tile(table: QTable, location: Vector2) -> Tuple[int, int]:
+        return location["X"] // table["TileSize"], location["Y"] // table["TileSize"]
+
+    @staticmethod
+    def Layer(table: QTable, carrying_food: bool, food_deposited: int) -> int:
+        if carrying_food:
+            return table["FoodCount"] + 1
+        return food_deposited
+
+    @staticmethod
+    def GetQValues(table: QTable, index: int, state: EnvState) -> np.ndarray:
+        x, y = QTableFunctions.Tile(table, state["AgentLocations"][index])
+        layer = QTableFunctions.Layer(table, state["CarryingFood"][index], state["FoodDeposited"])
+        return table["Values"][layer, x, y]
+
+    @staticmethod
+    def ForAgent(tables: List[QTable], index: int) -> QTable:
+        # With fewer tables than agents the tables are shared, e.g. a single table is read and written by every agent.
+        return tables[index % len(tables)]
+
+    @staticmethod
+    def Indices(table: QTable, state: EnvState) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # The layer, row and column of every agent at once.
+        count = len(state["AgentLocations"])
+        xs = np.fromiter((location["X"] for location in state["AgentLocations"]), dtype=np.intp, count=count)
+        ys = np.fromiter((location["Y"] for location in state["AgentLocations"]), dtype=np.intp, count=count)
+        carrying = np.fromiter(state["CarryingFood"], dtype=bool, count=count)
+        layers = np.where(carrying, table["FoodCount"] + 1, state["FoodDeposited"])
+        return layers, xs // table["TileSize"], ys // table["TileSize"]
+
+    @staticmethod
+    def UpdatePolicy(
+            table: QTable,
+            agent_index: int,
+            old_state: EnvState,
+            new_state: EnvState,
+            action: int,
+            reward: float,
+            discount_factor: float = DISCOUNT_FACTOR,
+            learning_rate: float = LEARNING_RATE,
+    ) -> None:
+        # Same backup as PolicyFunctions.UpdatePolicy. The write goes straight into the array, so tables placed in
+        # shared memory are updated in place without any locking.
+        old_values = QTableFunctions.GetQValues(table, agent_index, old_state)
+        new_values = QTableFunctions.GetQValues(table, agent_index, new_state)
+        target = reward + discount_factor * new_values.max()
+        old_values[action] += learning_rate * (target - old_values[action])
+
+    @staticmethod
+    def UpdatePolicies(
+            table: QTable,
+            old_state: EnvState,
+            new_state: EnvState,
+            actions: List[int],
+            rewards: List[float],
+            discount_factor: float = DISCOUNT_FACTOR,
+            learning_rate: float = LEARNING_RATE,
+    ) -> None:
+        # Backs up every agent's step into one shared table in a single batch. All targets are read before anything
+        # is written, so the result does not depend on agent order. Agents backing up the same entry share one
+        # update towards their average target, instead of overwriting each other or adding up past it.
+        values = table["Values"]
+        old = (*QTableFunctions.Indices(table, old_state), np.asarray(actions, dtype=np.intp))
+        new_values = values[QTableFunctions.Indices(table, new_state)].max(axis=-1)
+        targets = np.asarray(rewards, dtype=np.float64) + discount_factor * new_values
+        errors = targets - values[old]
+
+        _, inverse, counts = np.unique(np.ravel_multi_index(old, values.shape), return_inverse=True, return_counts=True)
+        np.add.at(values, old, learning_rate * errors / counts[inverse])
+
+    @staticmethod
+    def GetAction(
+            table: QTable,
+            agent_index: int,
+            generator: Generator,
+            state: EnvState,
+            epsilon: float
+    ) -> int:
+        if generator.random() > epsilon:
+            return int(np.argmax(QTableFunctions.GetQValues(table, agent_index, state)))
+        else:
+            return int(generator.integers(low=0, high=len(AGENT_ACTIONS)))
+
+    @staticmethod
+    def Merge(
+            tables: List[QTable],
+            weights: Optional[List[float]] = None,
+            layers: Union[int, slice, List[int]] = slice(None),
+            mask: Optional[np.ndarray] = None,
+    ) -> None:
+        # Replaces the selected layers of every table with their weighted average. The mask is a boolean
+        # Row -> Column array (or Layer -> Row -> Column) selecting which cells are merged.
+        if weights is None:
+            weights = [1.00] * len(tables)
+        weights = np.asarray(weights, dtype=np.float64)
+        weights = weights / weights.sum()
+
+        average = np.tensordot(weights, np.stack([table["Values"][layers] for table in tables]), axes=1)
+        for table in tables:
+            if mask is None:
+                table["Values"][layers] = average
+            else:
+                table["Values"][layers] = np.where(mask[..., np.newaxis], average, table["Values"][layers])
+        return None
+
+    @staticmethod
+    def MergeCell(tables: List[QTable], layer: int, location: Vector2) -> None:
+        # Averages the QValues of a single cell, used when agents meet.
+        x, y = QTableFunctions.Tile(tables[0], location)
+        values = np.stack([table["Values"][layer, x, y] for table in tables])
+        average = values.mean(axis=0)
+        for table in tables:
+            table["Values"][layer, x, y] = average
+        return None
+
+    @staticmethod
+    def MergeLayer(tables: List[QTable], food_deposited: int, weights: Optional[List[float]] = None) -> None:
+        # Merges only the layers agents can currently be on: the NoFood layer for the food deposited and HasFood.
+        QTableFunctions.Merge(tables, weights, [food_deposited, tables[0]["FoodCount"] + 1])
+        return None
+
+    @staticmethod
+    def FederatedAverage(tables: List[QTable], visits: Optional[List[int]] = None) -> None:
+        # Averages whole tables across agents, weighting each agent by how much experience it has (if given).
+        QTableFunctions.Merge(tables, visits)
+        return None
+
+    @staticmethod
+    def FromLookup(lookup: PolicyLookup, values: Optional[np.ndarray] = None) -> QTable:
+        grids = lookup["NoFood"] + [lookup["HasFood"]]
+        dense = np.array([[[policy["QValues"] for policy in column] for column in grid] for grid in grids], dtype=np.float64)
+        if values is None:
+            values = dense
+        else:
+            values[...] = dense
+        return {
+            "Values": values,
+            "FoodCount": len(lookup["NoFood"]) - 1,
+            "TileSize": 1,
+        }
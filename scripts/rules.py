@@ -0,0 +1,58 @@
+from typing import TypedDict, Literal
+from scripts.env import EnvFunctions, Env, Agent, Food
+
+
+class Rule(TypedDict):
+    Pickup: Literal["Any", "InOrder", "ReverseOrder"]
+    BlockedReward: float
+    PickupReward: float
+    DepositReward: float
+    StepReward: float
+
+
+class RuleFunctions:
+    @staticmethod
+    def Rule(
+            pickup: Literal["Any", "InOrder", "ReverseOrder"] = "Any",
+            blocked_reward: float = -1000,
+            pickup_reward: float = 10,
+            deposit_reward: float = 10,
+            step_reward: float = -1,
+    ) -> Rule:
+        return {
+            "Pickup": pickup,
+            "BlockedReward": blocked_reward,
+            "PickupReward": pickup_reward,
+            "DepositReward": deposit_reward,
+            "StepReward": step_reward,
+        }
+
+    @staticmethod
+    def PickupAllowed(env: Env, rule: Rule, food: Food) -> bool:
+        # InOrder only allows a food once every food before it has been deposited, and ReverseOrder once every
+        # food after it has. Both are checked against the deposit counters maintained by EnvFunctions.Deposit.
+        if rule["Pickup"] == "InOrder":
+            return env["DepositedPrefix"] >= food["Id"]
+        elif rule["Pickup"] == "ReverseOrder":
+            return env["DepositedSuffix"] >= len(env["Food"]) - 1 - food["Id"]
+        return True
+
+    @staticmethod
+    def UpdateAgent(env: Env, rule: Rule, agent: Agent, action: int) -> float:
+        # Moves the agent, then picks up or deposits food according to the rule, and returns the reward.
+        success = EnvFunctions.TryMoveAgent(env, agent, action)
+        if not success:
+            return rule["BlockedReward"]
+
+        food = EnvFunctions.OnDroppedFood(env, agent["Location"])
+        if food and EnvFunctions.CanPickup(agent, food) and RuleFunctions.PickupAllowed(env, rule, food):
+            EnvFunctions.GiveFood(agent, food)
+            return rule["PickupReward"]
+
+        nest = EnvFunctions.OnNest(env, agent["Location"])
+        if nest:
+            for food in agent["Food"]:
+                if EnvFunctions.CanDeposit(env, agent, food):
+                    EnvFunctions.Deposit(env, agent, food)
+                    return rule["DepositReward"]
+        return rule["StepReward"]
@@ -0,0 +1,190 @@
+from math import ceil
+from typing import TypedDict, List, Dict, Tuple, Any, Optional
+from numpy.random import Generator, PCG64
+from scripts.env import EnvFunctions, EnvParams
+from scripts.episode import Episode, EpisodeFunctions
+from scripts.evaluate import EvaluationFunctions, Evaluator, Evaluation
+from scripts.gymenv import GymFunctions, GymEnv
+from scripts.policy import DISCOUNT_FACTOR, LEARNING_RATE
+from scripts.qtable import QTableFunctions, QTable
+from scripts.datastore import DataStoreFunctions
+from tqdm import tqdm
+
+
+class SweepSpace(TypedDict):
+    DiscountFactor: Tuple[float, float]
+    LearningRate: Tuple[float, float]
+    DecayRate: Tuple[float, float]
+    Params: Dict[str, List[Any]] # EnvParams key -> Values to choose from
+
+
+class Candidate(TypedDict):
+    Params: EnvParams
+    Hyperparams: Dict[str, float]
+    Gym: GymEnv
+    Tables: List[QTable]
+    Evaluator: Evaluator
+    Evaluation: Optional[Evaluation]
+    Epsilon: float
+    Episodes: List[Episode]
+
+
+class SweepFunctions:
+    @staticmethod
+    def SweepSpace(
+            discount_factor: Tuple[float, float] = (DISCOUNT_FACTOR, DISCOUNT_FACTOR),
+            learning_rate: Tuple[float, float] = (LEARNING_RATE, LEARNING_RATE),
+            decay_rate: Tuple[float, float] = (0.0001, 0.01),
+            params: Optional[Dict[str, List[Any]]] = None,
+    ) -> SweepSpace:
+        return {
+            "DiscountFactor": discount_factor,
+            "LearningRate": learning_rate,
+            "DecayRate": decay_rate,
+            "Params": params or {},
+        }
+
+    @staticmethod
+    def Candidate(params: EnvParams, hyperparams: Dict[str, float]) -> Candidate:
+        return {
+            "Params": params,
+            "Hyperparams": hyperparams,
+            "Gym": GymFunctions.GymEnv(params),
+            "Tables": [QTableFunctions.QTable(params["GridSize"], params["FoodCount"]) for _ in range(params["AgentCount"])],
+            "Evaluator": EvaluationFunctions.Evaluator(params),
+            "Evaluation": None,
+            "Epsilon": 1,
+            "Episodes": [],
+        }
+
+    @staticmethod
+    def Sample(params: EnvParams, space: SweepSpace, count: int, generator: Generator) -> List[Candidate]:
+        # Hyperparams are drawn uniformly from their ranges and env params from their lists of values.
+        candidates = []
+        for _ in range(count):
+            candidate_params: EnvParams = dict(params)
+            for key, values in space["Params"].items():
+                candidate_params[key] = values[generator.integers(low=0, high=len(values))]
+
+            candidates.append(SweepFunctions.Candidate(candidate_params, {
+                "DiscountFactor": float(generator.uniform(*space["DiscountFactor"])),
+                "LearningRate": float(generator.uniform(*space["LearningRate"])),
+                "DecayRate": float(generator.uniform(*space["DecayRate"])),
+            }))
+        return candidates
+
+    @staticmethod
+    def Train(candidate: Candidate, episode_count: int) -> None:
+        # Continues training the candidate's tables, so each round only pays for the episodes it adds.
+        gym, tables, hyperparams = candidate["Gym"], candidate["Tables"], candidate["Hyperparams"]
+        env = gym["Env"]
+
+        for _ in range(episode_count):
+            GymFunctions.Reset(gym)
+            episode = EpisodeFunctions.Episode()
+            state = EnvFunctions.GetState(env)
+
+            while not gym["Terminated"][0] and not gym["Truncated"][0]:
+                actions = [
+                    QTableFunctions.GetAction(table, index, env["Generator"], state, candidate["Epsilon"])
+                    for index, table in enumerate(tables)
+                ]
+                _, rewards, _, _ = GymFunctions.Step(gym, actions)
+                new_state = EnvFunctions.GetState(env)
+
+                for index, table in enumerate(tables):
+                    QTableFunctions.UpdatePolicy(
+                        table=table,
+                        agent_index=index,
+                        old_state=state,
+                        new_state=new_state,
+                        action=actions[index],
+                        reward=rewards[index],
+                        discount_factor=hyperparams["DiscountFactor"],
+                        learning_rate=hyperparams["LearningRate"],
+                    )
+
+                episode["AverageRewards"].append(float(rewards.sum()))
+                candidate["Epsilon"] = max(0.00, candidate["Epsilon"] - hyperparams["DecayRate"])
+                state = new_state
+
+            candidate["Episodes"].append(episode)
+        return None
+
+    @staticmethod
+    def Score(candidate: Candidate, window: int = 10) -> Tuple[float, float, float]:
+        # Candidates are ranked by how often the greedy policy deposits all food, then by how efficiently. At the small
+        # budgets of the first rounds the greedy policy rarely succeeds at all, so the mean training return of the
+        # last window episodes breaks the ties.
+        evaluation = candidate["Evaluation"]
+        returns = [sum(episode["AverageRewards"]) for episode in candidate["Episodes"][-window:]]
+        return evaluation["SuccessRate"], evaluation["Efficiency"], sum(returns) / max(1, len(returns))
+
+    @staticmethod
+    def Save(candidate: Candidate) -> None:
+        # Saved under the number of episodes trained as well, so a full run with the same hyperparams never finds the
+        # candidate and views it instead of training.
+        hyperparams = dict(candidate["Hyperparams"], SweepEpisodes=len(candidate["Episodes"]))
+        DataStoreFunctions.Save(candidate["Params"], None, candidate["Episodes"], hyperparams)
+        DataStoreFunctions.SaveTables(candidate["Params"], candidate["Tables"], hyperparams)
+        return None
+
+    @staticmethod
+    def Run(
+            params: EnvParams,
+            space: SweepSpace,
+            candidate_count: int = 16,
+            min_episodes: int = 10,
+            keep: float = 0.50,
+            seed: int = 0,
+    ) -> List[Candidate]:
+        # Successive halving: every candidate trains for a small budget, the best fraction is kept, and the budget
+        # grows by the same factor each round until one candidate remains. Every candidate is saved to the run store
+        # when it is eliminated, and the winner at the end.
+        candidates = SweepFunctions.Sample(params, space, candidate_count, Generator(PCG64(seed)))
+        budget, trained = min_episodes, 0
+
+        while True:
+            for candidate in tqdm(candidates, desc=f"Sweep ({len(candidates)} candidates, {budget} episodes)"):
+                SweepFunctions.Train(candidate, budget - trained)
+                candidate["Evaluation"] = EvaluationFunctions.Evaluate(
+                    candidate["Evaluator"],
+                    candidate["Tables"],
+                    candidate["Gym"]["Rules"],
+                    len(candidate["Episodes"]),
+                )
+            trained = budget
+
+            candidates.sort(key=SweepFunctions.Score, reverse=True)
+            survivors = max(1, ceil(len(candidates) * keep))
+            for candidate in candidates[survivors:]:
+                SweepFunctions.Save(candidate)
+
+            candidates = candidates[:survivors]
+            if len(candidates) == 1:
+                SweepFunctions.Save(candidates[0])
+                return candidates
+            budget = ceil(budget / keep)
+
+
+if __name__ == "__main__":
+    params: EnvParams = {
+        "AgentCount": 2,
+        "FoodCount": 10,
+        "ObstacleCount": 10,
+        "NestCount": 1,
+        "GridSize": {"X": 15, "Y": 15},
+        "Seed": 9,
+        "MaxSteps": 10_000,
+        "EpisodeCount": 1000,
+        "ProximityRadius": 0.00,
+    }
+
+    space = SweepFunctions.SweepSpace(
+        discount_factor=(0.80, 0.99),
+        learning_rate=(0.01, 0.50),
+        decay_rate=(0.0001, 0.01),
+    )
+
+    best = SweepFunctions.Run(params, space)[0]
+    print(best["Hyperparams"], best["Evaluation"])
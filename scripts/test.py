@@ -1,109 +1,69 @@
-from typing import List, Any
-from scripts.env import EnvFunctions, Env, EnvParams, Agent, EnvState
+from typing import List, Any, Optional, Dict
+from scripts.env import EnvFunctions, Env, EnvParams, Agent, EnvState, AGENT_ACTIONS
 from scripts.datastore import DataStoreFunctions
 from scripts.event import EventFunctions
 from scripts.episode import Episode, EpisodeFunctions
-from scripts.policy import PolicyFunctions, PolicyLookup
+from scripts.policy import DISCOUNT_FACTOR, LEARNING_RATE
+from scripts.qtable import QTableFunctions, QTable
+from scripts.parallel import ParallelFunctions
+from scripts.evaluate import EvaluationFunctions, Evaluator
+from scripts.rules import RuleFunctions, Rule
+from scripts.checkpoint import CheckpointFunctions, Checkpointer, Checkpoint
+from scripts.memory import MemoryFunctions, MemoryBudget
+from scripts.heatmap import HeatmapFunctions
+from scripts.traces import TraceFunctions, Traces
+from scripts.tiling import TileCodingFunctions, TileCoding
 from scripts.vector import Vector2
+from tqdm import tqdm
+import tracemalloc
+import pygame
 
 
 class EnvTest:
     Actions: List[int] = []
     Rewards: List[int] = []
     Epsilon: float = 1
-    Lookups: List[PolicyLookup]
+    Tables: List[QTable]
+    Rules: List[Rule]
     Episodes: List[Episode]
     DecayRate: float
+    DiscountFactor: float = DISCOUNT_FACTOR
+    LearningRate: float = LEARNING_RATE
+    MergeInterval: int = 0
+    Traces: Optional[List[Traces]] = None # One per agent when training with Q(lambda).
+    Codings: Optional[List[TileCoding]] = None # Trained instead of the tables when tiles are larger than a cell.
+    Evaluator: Optional[Evaluator] = None
+    Checkpointer: Optional[Checkpointer] = None
+    Budget: Optional[MemoryBudget] = None
+    SpilledEpisodes: int = 0
+    NextEpisode: int = 0 # The first episode not trained yet.
+    Finished: bool = False # Set once the last episode was trained or training converged.
+    EpisodeBytes: int = 0
+    Params: EnvParams
+    Hyperparams: Optional[Dict[str, float]] = None
+    HeatmapAgent: int = 0
+    HeatmapLayer: Optional[int] = None # None follows the layer the agent is currently on.
+    HeatmapAction: Optional[int] = None # None shows the max QValue.
+    ColorMap = HeatmapFunctions.ColorMap()
     CurrentEpisode: Episode
     Env: Env
 
-    @staticmethod
-    def BeforeDeposited(food_index: int) -> bool:
-        for index, food in enumerate(env["Food"]):
-            if index < food_index and food["Status"] != "Deposited":
-                return False
-        return True
-
-    @staticmethod
-    def AfterDeposited(food_index: int) -> bool:
-        for index, food in enumerate(env["Food"]):
-            if index > food_index and food["Status"] != "Deposited":
-                return False
-        return True
-
-    @staticmethod
-    def UpdateAgent1(agent: Agent, action: int):
-        success = EnvFunctions.TryMoveAgent(EnvTest.Env, agent, action)
-        if not success:
-            return -1000
-
-        food = EnvFunctions.OnDroppedFood(EnvTest.Env, agent["Location"])
-        if food and EnvFunctions.CanPickup(agent, food):
-            # Only pickup if all prior food has been deposited.
-            if EnvTest.BeforeDeposited(EnvTest.Env["Food"].index(food)):
-                EnvFunctions.GiveFood(agent, food)
-                return 10
-
-        nest = EnvFunctions.OnNest(EnvTest.Env, agent["Location"])
-        if nest:
-            for food in agent["Food"]:
-                if EnvFunctions.CanDeposit(EnvTest.Env, agent, food):
-                    EnvFunctions.Deposit(EnvTest.Env, agent, food)
-                    return 10
-        return -1
-
-    @staticmethod
-    def UpdateAgent2(agent: Agent, action: int):
-        success = EnvFunctions.TryMoveAgent(EnvTest.Env, agent, action)
-        if not success:
-            return -1000
-
-        food = EnvFunctions.OnDroppedFood(EnvTest.Env, agent["Location"])
-        if food and EnvFunctions.CanPickup(agent, food):
-            # Only pickup if all food after has been deposited.
-            if EnvTest.AfterDeposited(EnvTest.Env["Food"].index(food)):
-                EnvFunctions.GiveFood(agent, food)
-                return 10
-
-        nest = EnvFunctions.OnNest(EnvTest.Env, agent["Location"])
-        if nest:
-            for food in agent["Food"]:
-                if EnvFunctions.CanDeposit(EnvTest.Env, agent, food):
-                    EnvFunctions.Deposit(EnvTest.Env, agent, food)
-                    return 10
-        return -1
-
-    @staticmethod
-    def UpdateAgent3(agent: Agent, action: int):
-        success = EnvFunctions.TryMoveAgent(EnvTest.Env, agent, action)
-        if not success:
-            return -1000
-
-        food = EnvFunctions.OnDroppedFood(EnvTest.Env, agent["Location"])
-        if food and EnvFunctions.CanPickup(agent, food):
-            EnvFunctions.GiveFood(agent, food)
-            return 10
-
-        nest = EnvFunctions.OnNest(EnvTest.Env, agent["Location"])
-        if nest:
-            for food in agent["Food"]:
-                if EnvFunctions.CanDeposit(EnvTest.Env, agent, food):
-                    EnvFunctions.Deposit(EnvTest.Env, agent, food)
-                    return 10
-        return -1
-
     @staticmethod
     def UpdateAgent(agent: Agent, index: int, action: int):
-        # if index == 1:
-        #     return EnvTest.UpdateAgent1(agent, action)
-        # elif index == 2:
-        #     return EnvTest.UpdateAgent2(agent, action)
-        return EnvTest.UpdateAgent3(agent, action)
+        return RuleFunctions.UpdateAgent(EnvTest.Env, EnvTest.Rules[index], agent, action)
 
     @staticmethod
     def QAction(agent_index: int, state: EnvState):
-        return PolicyFunctions.GetAction(
-            lookup=EnvTest.Lookups[agent_index],
+        if EnvTest.Codings:
+            return TileCodingFunctions.GetAction(
+                coding=TileCodingFunctions.ForAgent(EnvTest.Codings, agent_index),
+                agent_index=agent_index,
+                generator=EnvTest.Env["Generator"],
+                state=state,
+                epsilon=EnvTest.Epsilon
+            )
+        return QTableFunctions.GetAction(
+            table=QTableFunctions.ForAgent(EnvTest.Tables, agent_index),
             agent_index=agent_index,
             generator=EnvTest.Env["Generator"],
             state=state,
@@ -124,19 +84,63 @@ class EnvTest:
 
     @staticmethod
     def OnTrainingStepEnded(message: Any):
-        total_rewards, count = 0, 1
-        # Update each agent's policy with the chosen action and resulting rewards.
-        for index, agent in enumerate(EnvTest.Env["Agents"]):
-            total_rewards += EnvTest.Rewards[index]
-            PolicyFunctions.UpdatePolicy(
-                lookup=lookups[index],
-                agent_index=index,
+        total_rewards, count = sum(EnvTest.Rewards), 1
+
+        # Tile codings update every resolution of each agent's coding.
+        if EnvTest.Codings:
+            for index, agent in enumerate(EnvTest.Env["Agents"]):
+                TileCodingFunctions.UpdatePolicy(
+                    coding=TileCodingFunctions.ForAgent(EnvTest.Codings, index),
+                    agent_index=index,
+                    old_state=message["OldState"],
+                    new_state=message["NewState"],
+                    action=EnvTest.Actions[index],
+                    reward=EnvTest.Rewards[index],
+                    discount_factor=EnvTest.DiscountFactor,
+                    learning_rate=EnvTest.LearningRate,
+                )
+
+        # A table shared by every agent is updated by all of them in one batch.
+        elif len(EnvTest.Tables) == 1 and not EnvTest.Traces:
+            QTableFunctions.UpdatePolicies(
+                table=EnvTest.Tables[0],
                 old_state=message["OldState"],
                 new_state=message["NewState"],
-                action=EnvTest.Actions[index],
-                reward=EnvTest.Rewards[index],
+                actions=EnvTest.Actions,
+                rewards=EnvTest.Rewards,
+                discount_factor=EnvTest.DiscountFactor,
+                learning_rate=EnvTest.LearningRate,
             )
 
+        # Otherwise update each agent's policy with the chosen action and resulting rewards.
+        elif EnvTest.Traces:
+            for index, agent in enumerate(EnvTest.Env["Agents"]):
+                TraceFunctions.UpdatePolicy(
+                    table=QTableFunctions.ForAgent(EnvTest.Tables, index),
+                    traces=EnvTest.Traces[index],
+                    agent_index=index,
+                    old_state=message["OldState"],
+                    new_state=message["NewState"],
+                    action=EnvTest.Actions[index],
+                    reward=EnvTest.Rewards[index],
+                    discount_factor=EnvTest.DiscountFactor,
+                    learning_rate=EnvTest.LearningRate,
+                    blocked=EnvTest.Rewards[index] == EnvTest.Rules[index]["BlockedReward"],
+                )
+
+        else:
+            for index, agent in enumerate(EnvTest.Env["Agents"]):
+                QTableFunctions.UpdatePolicy(
+                    table=QTableFunctions.ForAgent(EnvTest.Tables, index),
+                    agent_index=index,
+                    old_state=message["OldState"],
+                    new_state=message["NewState"],
+                    action=EnvTest.Actions[index],
+                    reward=EnvTest.Rewards[index],
+                    discount_factor=EnvTest.DiscountFactor,
+                    learning_rate=EnvTest.LearningRate,
+                )
+
         # Add the average reward to the current episode and reduce epsilon.
         EnvTest.CurrentEpisode["AverageRewards"].append(total_rewards / count)
         EnvTest.Epsilon -= EnvTest.DecayRate
@@ -156,39 +160,124 @@ class EnvTest:
             return EnvTest.QAction(agent_index, message["State"])
         EnvFunctions.DrawArrows(EnvTest.Env, callback, message["Surface"])
 
+    @staticmethod
+    def OnRenderedHeatmap(message: Any):
+        table = QTableFunctions.ForAgent(EnvTest.Tables, EnvTest.HeatmapAgent)
+        layer = EnvTest.HeatmapLayer
+        if layer is None:
+            layer = QTableFunctions.Layer(
+                table,
+                message["State"]["CarryingFood"][EnvTest.HeatmapAgent],
+                message["State"]["FoodDeposited"],
+            )
+
+        values = HeatmapFunctions.Values(table, layer, EnvTest.Env["GridSize"], EnvTest.HeatmapAction)
+        HeatmapFunctions.Draw(message["Surface"], values, EnvTest.ColorMap)
+
+    @staticmethod
+    def OnHeatmapKeyPressed(message: Any):
+        # UP and DOWN step through the NoFood layers and HasFood (the last layer), H shows HasFood, F follows the
+        # agent again, A switches agent and Q switches between the max QValue and each action.
+        layer_count = QTableFunctions.ForAgent(EnvTest.Tables, EnvTest.HeatmapAgent)["FoodCount"] + 2
+        current = EnvTest.HeatmapLayer if EnvTest.HeatmapLayer is not None else 0
+
+        if message["Key"] == pygame.K_UP:
+            EnvTest.HeatmapLayer = (current + 1) % layer_count
+        elif message["Key"] == pygame.K_DOWN:
+            EnvTest.HeatmapLayer = (current - 1) % layer_count
+        elif message["Key"] == pygame.K_h:
+            EnvTest.HeatmapLayer = layer_count - 1
+        elif message["Key"] == pygame.K_f:
+            EnvTest.HeatmapLayer = None
+        elif message["Key"] == pygame.K_a:
+            EnvTest.HeatmapAgent = (EnvTest.HeatmapAgent + 1) % len(EnvTest.Env["Agents"])
+        elif message["Key"] == pygame.K_q:
+            actions = [None] + list(range(len(AGENT_ACTIONS)))
+            EnvTest.HeatmapAction = actions[(actions.index(EnvTest.HeatmapAction) + 1) % len(actions)]
+
     @staticmethod
     def OnEpisodeStarted(message: Any):
-        pass
+        # Traces never carry over from the last episode.
+        for traces in EnvTest.Traces or []:
+            TraceFunctions.Reset(traces)
 
     @staticmethod
     def OnEpisodeEnded(message: Any):
+        # A closed window (or a terminated process) stops training part way through an episode. That episode is left
+        # out and trained again when the run is resumed.
+        if not EnvTest.Env["Running"]:
+            return
+
         # Add the current episode to the episode list and then create a new episode.
         EnvTest.Episodes.append(EnvTest.CurrentEpisode)
         EnvTest.CurrentEpisode = EpisodeFunctions.Episode()
+        EnvTest.NextEpisode = message["Episode"] + 1
+        EnvTest.Finished = EnvTest.NextEpisode == EnvTest.Params["EpisodeCount"]
+
+        # Spill the episodes to disk once they outgrow the memory budget.
+        if EnvTest.Budget and EnvTest.Budget["EpisodeBytes"] is not None:
+            EnvTest.EpisodeBytes += MemoryFunctions.EpisodeBytes(EnvTest.Episodes[-1])
+            if EnvTest.EpisodeBytes > EnvTest.Budget["EpisodeBytes"]:
+                MemoryFunctions.Spill(EnvTest.Params, EnvTest.Episodes, EnvTest.SpilledEpisodes, EnvTest.Hyperparams)
+                EnvTest.SpilledEpisodes += len(EnvTest.Episodes)
+                EnvTest.Episodes.clear()
+                EnvTest.EpisodeBytes = 0
+
+        # Periodically average every agent's policies together.
+        if EnvTest.MergeInterval > 0 and (message["Episode"] + 1) % EnvTest.MergeInterval == 0:
+            for tables in EnvTest.Resolutions():
+                QTableFunctions.FederatedAverage(tables)
+
+        # Periodically evaluate the greedy policy and end training once it has converged.
+        if EnvTest.Evaluator and (message["Episode"] + 1) % EnvTest.Evaluator["Interval"] == 0:
+            evaluation = EvaluationFunctions.Evaluate(EnvTest.Evaluator, EnvTest.PolicyTables(), EnvTest.Rules, message["Episode"])
+            if EvaluationFunctions.ShouldStop(EnvTest.Evaluator, evaluation):
+                EnvTest.Env["Running"] = False
+                EnvTest.Finished = True
+
+        # Periodically save a checkpoint in the background so a crashed run can be resumed.
+        if EnvTest.Checkpointer and (message["Episode"] + 1) % EnvTest.Checkpointer["Interval"] == 0:
+            CheckpointFunctions.Save(EnvTest.Checkpointer, EnvTest.Snapshot())
+
+    @staticmethod
+    def Snapshot() -> Checkpoint:
+        return CheckpointFunctions.Snapshot(
+            checkpointer=EnvTest.Checkpointer,
+            episode=EnvTest.NextEpisode,
+            epsilon=EnvTest.Epsilon,
+            generator_state=EnvTest.Env["Generator"].bit_generator.state,
+            tables=TileCodingFunctions.Tables(EnvTest.Codings) if EnvTest.Codings else EnvTest.Tables,
+            episodes=EnvTest.Episodes,
+            streak=EnvTest.Evaluator["Streak"] if EnvTest.Evaluator else 0,
+        )
 
     @staticmethod
     def OnProximityDetected(message: Any):
-        index1 = EnvTest.Env["Agents"].index(message["Agent1"])
-        index2 = EnvTest.Env["Agents"].index(message["Agent2"])
-        state = EnvFunctions.GetState(EnvTest.Env)
-
-        if state["CarryingFood"][index1] == state["CarryingFood"][index2]:
-            state["AgentLocations"] = [message["Agent1"]["Location"]] * len(EnvTest.Env["Agents"])
-            policy1 = PolicyFunctions.GetPolicy(
-                lookup=EnvTest.Lookups[index1],
-                index=index1,
-                state=state,
-            )
+        index1, index2 = message["Index1"], message["Index2"]
+        carrying1 = len(message["Agent1"]["Food"]) > 0
+        carrying2 = len(message["Agent2"]["Food"]) > 0
 
-            policy2 = PolicyFunctions.GetPolicy(
-                lookup=EnvTest.Lookups[index2],
-                index=index2,
-                state=state,
-            )
+        for resolution in EnvTest.Resolutions():
+            tables = [QTableFunctions.ForAgent(resolution, index1), QTableFunctions.ForAgent(resolution, index2)]
+            if tables[0] is not tables[1] and carrying1 == carrying2:
+                # Average both agents' QValues for the cell (or tile) the first agent is on.
+                layer = QTableFunctions.Layer(tables[0], carrying1, EnvTest.Env["FoodDeposited"])
+                QTableFunctions.MergeCell(tables, layer, message["Agent1"]["Location"])
 
-            for index, value in enumerate(policy1["QValues"]):
-                policy1["QValues"][index] = (value + policy2["QValues"][index]) / 2
-                policy2["QValues"][index] = policy1["QValues"][index]
+    @staticmethod
+    def Resolutions() -> List[List[QTable]]:
+        # The tables being trained grouped by resolution, so agents' tables are only ever merged with tables of the
+        # same tile size.
+        if EnvTest.Codings:
+            return [list(tables) for tables in zip(*(coding["Tables"] for coding in EnvTest.Codings))]
+        return [EnvTest.Tables]
+
+    @staticmethod
+    def PolicyTables() -> List[QTable]:
+        # The policies being trained as QTables, tile codings are averaged into one QTable per cell.
+        if EnvTest.Codings:
+            return [TileCodingFunctions.ToTable(coding) for coding in EnvTest.Codings]
+        return EnvTest.Tables
 
 if __name__ == "__main__":
     params: EnvParams = {
@@ -203,20 +292,108 @@ if __name__ == "__main__":
         "ProximityRadius": 0.00,
     }
 
-    lookups, episodes = DataStoreFunctions.Load(params)
+    # Number of processes training on shared policies. Proximity sharing and checkpoints are only used when training
+    # on one process.
+    worker_count = 1
+
+    # Cells per side of the coarse tiles, 1 learns every cell separately. Above 1 each agent learns with tile coding:
+    # its QValues are the average of a table per cell and a table per tile, so what is learned in one cell carries
+    # over to its neighbours while every cell can still tell its actions apart. Only used on one process without
+    # traces.
+    tile_size = 1
+
+    # Lambda of the eligibility traces, 0 uses one-step Q-learning. Only used on one process.
+    trace_decay = 0.00
+
+    # One table read and written by every agent instead of a table per agent, so memory does not grow with agents.
+    shared_policy = False
+
+    # Discount factor, learning rate and epsilon decay rate (per step) to train with, e.g. the winner of a sweep from
+    # DataStoreFunctions.BestRun(...)["Hyperparams"]. Missing ones keep their defaults.
+    training_hyperparams: Dict[str, float] = {}
+
+    # Memory limits in bytes, None for no limit. Params whose policies would not fit are refused before loading.
+    budget = MemoryFunctions.MemoryBudget(table_bytes=None, episode_bytes=None)
+    MemoryFunctions.CheckBudget(params, budget, tile_size, shared_policy)
+
+    # Runs that were already trained map their saved QTables, new ones start from empty tables. The hyperparams and
+    # table settings are part of the run's name, so a run is never resumed or viewed with different ones.
+    hyperparams = {
+        key: training_hyperparams[key]
+        for key in ("DiscountFactor", "LearningRate", "DecayRate")
+        if key in training_hyperparams
+    }
+    hyperparams = dict(hyperparams, **(DataStoreFunctions.TableSettings(tile_size, shared_policy) or {})) or None
+    tables, episodes = DataStoreFunctions.LoadTables(params, hyperparams)
+    trained = tables is not None
+    if not trained and tile_size > 1 and (worker_count > 1 or trace_decay > 0):
+        raise ValueError("Tile coding trains on one process without traces, use tile_size = 1 for those.")
+    if not trained and tile_size > 1:
+        EnvTest.Codings = [
+            TileCodingFunctions.TileCoding(params["GridSize"], params["FoodCount"], tile_sizes=(1, tile_size))
+            for _ in range(1 if shared_policy else params["AgentCount"])
+        ]
+        tables = [] # Filled from the codings once training is done, see EnvTest.PolicyTables.
+    elif not trained:
+        tables = [
+            QTableFunctions.QTable(params["GridSize"], params["FoodCount"])
+            for _ in range(1 if shared_policy else params["AgentCount"])
+        ]
     env: Env = EnvFunctions.Env(params)
 
     # Config the custom functions.
-    EnvTest.Lookups = lookups
+    EnvTest.Tables = tables
+    EnvTest.Rules = [RuleFunctions.Rule() for _ in range(params["AgentCount"])]
+    # EnvTest.Rules[1] = RuleFunctions.Rule("InOrder")
+    # EnvTest.Rules[2] = RuleFunctions.Rule("ReverseOrder")
     EnvTest.Episodes = episodes
-    EnvTest.DecayRate = 1 / params["EpisodeCount"]
+    EnvTest.DecayRate = training_hyperparams.get("DecayRate", 1 / params["EpisodeCount"])
+    EnvTest.DiscountFactor = training_hyperparams.get("DiscountFactor", DISCOUNT_FACTOR)
+    EnvTest.LearningRate = training_hyperparams.get("LearningRate", LEARNING_RATE)
     EnvTest.Env = env
     EnvTest.CurrentEpisode = EpisodeFunctions.Episode()
+    EnvTest.Evaluator = EvaluationFunctions.Evaluator(params)
+    EnvTest.Checkpointer = CheckpointFunctions.Checkpointer(params, hyperparams=hyperparams) if worker_count == 1 and not trained else None
+    EnvTest.Budget = budget
+    EnvTest.Params = params
+    EnvTest.Hyperparams = hyperparams
+    if trace_decay > 0:
+        EnvTest.Traces = [TraceFunctions.Traces(decay=trace_decay) for _ in range(params["AgentCount"])]
 
     # Initialize pygame and the env.
     EnvFunctions.Init(env)
-
-    if len(episodes) == 0:
+    if not EnvFunctions.IsReachable(env):
+        raise ValueError("Some food cannot be reached or carried to a nest in this layout.")
+
+    # Resume from the latest checkpoint if an earlier run stopped before finishing training.
+    start_episode = 0
+    checkpoint = CheckpointFunctions.Load(params, hyperparams) if not trained else None
+    if checkpoint and worker_count > 1:
+        raise ValueError("This run has a checkpoint from training on one process, resume it with worker_count = 1.")
+    if checkpoint:
+        if EnvTest.Codings:
+            EnvTest.Codings = TileCodingFunctions.FromTables(checkpoint["Tables"], len(EnvTest.Codings[0]["Tables"]))
+        else:
+            EnvTest.Tables = checkpoint["Tables"]
+        EnvTest.Epsilon = checkpoint["Epsilon"]
+        env["Generator"].bit_generator.state = checkpoint["GeneratorState"]
+        episodes.extend(checkpoint["Episodes"])
+        start_episode = EnvTest.NextEpisode = checkpoint["Episode"]
+        EnvTest.Finished = start_episode == params["EpisodeCount"]
+        EnvTest.SpilledEpisodes = start_episode - len(checkpoint["Episodes"])
+        EnvTest.Evaluator["Streak"] = checkpoint.get("Streak", 0)
+
+    # Drop episodes spilled after the checkpoint (or by a run that never reached one).
+    if not trained:
+        MemoryFunctions.Truncate(params, EnvTest.SpilledEpisodes, hyperparams)
+
+    if not trained and worker_count > 1:
+        # Train on several processes and save the training results.
+        episodes.extend(ParallelFunctions.RunTrain(params, EnvTest.Tables, worker_count, EnvTest.Rules, hyperparams))
+        DataStoreFunctions.Save(params, None, episodes, hyperparams)
+        DataStoreFunctions.SaveTables(params, EnvTest.Tables, hyperparams)
+
+    elif not trained:
         # Connect the training events and start training.
         EventFunctions.Connect(env["StepStarted"], EnvTest.OnTrainingStepStarted)
         EventFunctions.Connect(env["StepEnded"], EnvTest.OnTrainingStepEnded)
@@ -224,7 +401,21 @@ if __name__ == "__main__":
         EventFunctions.Connect(env["EpisodeEnded"], EnvTest.OnEpisodeEnded)
         EventFunctions.Connect(env["ProximityDetected"], EnvTest.OnProximityDetected)
 
-        EnvFunctions.RunTrain(env)
+        try:
+            EnvFunctions.RunTrain(env, start_episode)
+        finally:
+            CheckpointFunctions.Close(EnvTest.Checkpointer)
+
+        # An interrupted run is not saved as trained. Its progress goes into a final checkpoint instead, which the
+        # next start resumes from.
+        if not EnvTest.Finished:
+            CheckpointFunctions.Write(EnvTest.Checkpointer["Directory"], EnvTest.Snapshot(), EnvTest.Checkpointer["Keep"])
+            raise SystemExit(f"Training stopped at episode {EnvTest.NextEpisode}, run again to resume it.")
+
+        # Report memory use when a budget is set or allocations are being traced.
+        if budget["TableBytes"] is not None or budget["EpisodeBytes"] is not None or tracemalloc.is_tracing():
+            tables = TileCodingFunctions.Tables(EnvTest.Codings) if EnvTest.Codings else EnvTest.Tables
+            tqdm.write(MemoryFunctions.Format(MemoryFunctions.Report(env, tables, episodes)))
 
         # Disconnect the training events.
         EventFunctions.DisconnectAll(env["StepStarted"])
@@ -232,16 +423,30 @@ if __name__ == "__main__":
         EventFunctions.DisconnectAll(env["EpisodeStarted"])
         EventFunctions.DisconnectAll(env["EpisodeEnded"])
 
-        # Save the training results.
-        DataStoreFunctions.Save(params, lookups, episodes)
-
-    # Plot the training results.
-    EpisodeFunctions.PlotRewards(episodes)
-    EpisodeFunctions.PlotSteps(episodes)
+        # Save the training results. The tables are written last, so a run only counts as trained once complete.
+        # Tile codings are saved as the QTables they act like, which is all testing and viewing need. Spilled
+        # episodes are copied into the payload a chunk at a time.
+        EnvTest.Tables, EnvTest.Codings = EnvTest.PolicyTables(), None
+        spilled = MemoryFunctions.Chunks(params, EnvTest.SpilledEpisodes, hyperparams)
+        DataStoreFunctions.Save(params, None, episodes, hyperparams, spilled)
+        DataStoreFunctions.SaveTables(params, EnvTest.Tables, hyperparams)
+        CheckpointFunctions.Remove(params, hyperparams)
+        MemoryFunctions.RemoveSpill(params, hyperparams)
+
+    # Plot the training results. Newly trained runs are streamed from their payload, which also holds the episodes
+    # that were spilled.
+    path = DataStoreFunctions.PayloadPath(params, hyperparams)
+    EpisodeFunctions.PlotRewards(episodes if trained else DataStoreFunctions.Episodes(path))
+    EpisodeFunctions.PlotSteps(episodes if trained else DataStoreFunctions.Episodes(path))
+    EpisodeFunctions.PlotEfficiency(episodes if trained else DataStoreFunctions.Episodes(path), env["OptimalSteps"])
 
     # Draw decision arrows on render.
     # EventFunctions.Connect(env["Rendered"], EnvConfig.OnRendered)
 
+    # Draw a heatmap of the QValues on render.
+    # EventFunctions.Connect(env["Rendered"], EnvTest.OnRenderedHeatmap)
+    # EventFunctions.Connect(env["KeyPressed"], EnvTest.OnHeatmapKeyPressed)
+
     # Connect the testing events and view result of training.
     EventFunctions.Connect(env["StepStarted"], EnvTest.OnTestingStepStarted)
     EnvFunctions.RunTest(env)
\ No newline at end of file
@@ -0,0 +1,83 @@
+from typing import TypedDict, List, Tuple
+import numpy as np
+from numpy.random import Generator
+from scripts.env import EnvState, AGENT_ACTIONS
+from scripts.policy import DISCOUNT_FACTOR, LEARNING_RATE
+from scripts.qtable import QTableFunctions, QTable
+from vector import Vector2
+
+
+class TileCoding(TypedDict):
+    Tables: List[QTable] # One table per resolution, from finest to coarsest.
+
+
+class TileCodingFunctions:
+    @staticmethod
+    def TileCoding(size: Vector2, food_count: int, tile_sizes: Tuple[int, ...] = (1, 4, 16)) -> TileCoding:
+        # Multi-resolution tile coding. The QValues of a cell are the average of its tile at every resolution, so
+        # coarse tiles give a rough estimate for cells that are rarely visited and fine tiles refine it where
+        # agents spend their time.
+        return {
+            "Tables": [QTableFunctions.QTable(size, food_count, tile_size=tile_size) for tile_size in tile_sizes],
+        }
+
+    @staticmethod
+    def ForAgent(codings: List[TileCoding], index: int) -> TileCoding:
+        return codings[index % len(codings)]
+
+    @staticmethod
+    def GetQValues(coding: TileCoding, index: int, state: EnvState) -> np.ndarray:
+        values = np.zeros(len(AGENT_ACTIONS), dtype=np.float64)
+        for table in coding["Tables"]:
+            values += QTableFunctions.GetQValues(table, index, state)
+        return values / len(coding["Tables"])
+
+    @staticmethod
+    def UpdatePolicy(
+            coding: TileCoding,
+            agent_index: int,
+            old_state: EnvState,
+            new_state: EnvState,
+            action: int,
+            reward: float,
+            discount_factor: float = DISCOUNT_FACTOR,
+            learning_rate: float = LEARNING_RATE,
+    ) -> None:
+        # Moving every resolution by the full error moves their average by the same amount as a tabular update.
+        predict = TileCodingFunctions.GetQValues(coding, agent_index, old_state)[action]
+        target = reward + discount_factor * TileCodingFunctions.GetQValues(coding, agent_index, new_state).max()
+        for table in coding["Tables"]:
+            QTableFunctions.GetQValues(table, agent_index, old_state)[action] += learning_rate * (target - predict)
+
+    @staticmethod
+    def GetAction(
+            coding: TileCoding,
+            agent_index: int,
+            generator: Generator,
+            state: EnvState,
+            epsilon: float
+    ) -> int:
+        if generator.random() > epsilon:
+            return int(np.argmax(TileCodingFunctions.GetQValues(coding, agent_index, state)))
+        else:
+            return int(generator.integers(low=0, high=len(AGENT_ACTIONS)))
+
+    @staticmethod
+    def ToTable(coding: TileCoding) -> QTable:
+        # The averaged QValues of every cell as one QTable at the resolution of the finest table (per cell). It acts
+        # exactly like the coding, so evaluating, saving and viewing a trained run need nothing but QTables.
+        fine = coding["Tables"][0]
+        values = np.zeros_like(fine["Values"])
+        for table in coding["Tables"]:
+            tiled = np.repeat(np.repeat(table["Values"], table["TileSize"], axis=1), table["TileSize"], axis=2)
+            values += tiled[:, :values.shape[1], :values.shape[2]]
+        return QTableFunctions.QTable({"X": values.shape[1], "Y": values.shape[2]}, fine["FoodCount"], values / len(coding["Tables"]))
+
+    @staticmethod
+    def Tables(codings: List[TileCoding]) -> List[QTable]:
+        # Every resolution of every coding in one list, e.g. to checkpoint them.
+        return [table for coding in codings for table in coding["Tables"]]
+
+    @staticmethod
+    def FromTables(tables: List[QTable], resolutions: int) -> List[TileCoding]:
+        return [{"Tables": tables[index:index + resolutions]} for index in range(0, len(tables), resolutions)]
@@ -0,0 +1,95 @@
+from typing import TypedDict
+import numpy as np
+from scripts.env import EnvState
+from scripts.policy import DISCOUNT_FACTOR, LEARNING_RATE
+from scripts.qtable import QTableFunctions, QTable
+
+
+class Traces(TypedDict):
+    Indices: np.ndarray # Flat indices into the QTable values of the active state-actions.
+    Values: np.ndarray # Eligibility of each active state-action.
+    Count: int # Number of active state-actions, stored at the front of Indices and Values.
+    Decay: float # Lambda, how much of the eligibility is kept per step on top of the discount factor.
+    Cutoff: float # Traces below this are dropped.
+
+
+class TraceFunctions:
+    @staticmethod
+    def Traces(capacity: int = 256, decay: float = 0.90, cutoff: float = 0.01) -> Traces:
+        # Only recently visited state-actions carry a trace, so they are kept in small fixed size arrays instead
+        # of a trace for every entry of the QTable.
+        return {
+            "Indices": np.zeros(capacity, dtype=np.intp),
+            "Values": np.zeros(capacity, dtype=np.float64),
+            "Count": 0,
+            "Decay": decay,
+            "Cutoff": cutoff,
+        }
+
+    @staticmethod
+    def Reset(traces: Traces) -> None:
+        traces["Count"] = 0
+        return None
+
+    @staticmethod
+    def Visit(traces: Traces, index: int) -> None:
+        # Sets the trace of a state-action to 1 (replacing traces). When full, the weakest trace makes room.
+        count = traces["Count"]
+        found = np.flatnonzero(traces["Indices"][:count] == index)
+
+        if len(found) > 0:
+            slot = found[0]
+        elif count < len(traces["Indices"]):
+            slot = count
+            traces["Count"] += 1
+        else:
+            slot = int(np.argmin(traces["Values"]))
+
+        traces["Indices"][slot] = index
+        traces["Values"][slot] = 1.00
+        return None
+
+    @staticmethod
+    def UpdatePolicy(
+            table: QTable,
+            traces: Traces,
+            agent_index: int,
+            old_state: EnvState,
+            new_state: EnvState,
+            action: int,
+            reward: float,
+            discount_factor: float = DISCOUNT_FACTOR,
+            learning_rate: float = LEARNING_RATE,
+            blocked: bool = False,
+    ) -> None:
+        # Watkins's Q(lambda). The error of every step is also applied to the state-actions that led to it, so
+        # rewards travel back along the whole recent path instead of one cell per visit. Following an exploratory
+        # action the earlier path no longer leads to the greedy return, so the traces are cleared first. Exploratory
+        # means anything but the action GetAction picks greedily, so ties between untrained QValues do not let a
+        # blocked move's reward leak onto the path. A blocked move's penalty is large enough to swamp every other
+        # reward, so it only ever updates the move itself and the path starts over after it.
+        values = table["Values"]
+        old_values = QTableFunctions.GetQValues(table, agent_index, old_state)
+        new_values = QTableFunctions.GetQValues(table, agent_index, new_state)
+
+        if blocked or action != np.argmax(old_values):
+            TraceFunctions.Reset(traces)
+
+        layer = QTableFunctions.Layer(table, old_state["CarryingFood"][agent_index], old_state["FoodDeposited"])
+        x, y = QTableFunctions.Tile(table, old_state["AgentLocations"][agent_index])
+        TraceFunctions.Visit(traces, int(np.ravel_multi_index((layer, x, y, action), values.shape)))
+
+        error = reward + discount_factor * new_values.max() - old_values[action]
+        count = traces["Count"]
+        values[np.unravel_index(traces["Indices"][:count], values.shape)] += learning_rate * error * traces["Values"][:count]
+        if blocked:
+            TraceFunctions.Reset(traces)
+            return None
+
+        # Decay every trace and drop the ones that no longer matter.
+        traces["Values"][:count] *= discount_factor * traces["Decay"]
+        keep = np.flatnonzero(traces["Values"][:count] >= traces["Cutoff"])
+        traces["Indices"][:len(keep)] = traces["Indices"][keep]
+        traces["Values"][:len(keep)] = traces["Values"][keep]
+        traces["Count"] = len(keep)
+        return None